@@ -0,0 +1,222 @@
+#!/usr/bin/python
+""" benchmark
+    ---------
+    generates a synthetic tree of experiments with evolution.conf,
+    evolution.log, fitness.log, population.log and data/data.log,
+    using the column layout of the robot (see create_columns), and
+    times the analysis paths on it:
+        + find_experiments of common.py and status.py (cold and warm index)
+        + get_best_worst_median
+        + results.read_data_log (cold without and warm with its cache)
+        + plotting an evolog
+    timings are appended to a log and compared with the last run of the
+    same scale, so regressions become visible.
+    e.g. ./benchmark.py -r 31 -n 20 -t 10000 -e 10 -s 1000
+"""
+
+import matplotlib
+matplotlib.use("Agg") # no display needed
+
+import os, sys, json, time, shutil, argparse, subprocess
+from os.path import isfile
+from timeit import default_timer
+import numpy as np
+
+import config
+import expindex
+import common
+import status
+import results
+import plot_evo_logs
+
+bench_path = "../data/bench/"
+result_log = bench_path + "benchmark.log"
+
+
+def generate_experiment(folder, robot_id, trials, episodes, steps, rng):
+    common.create_folder(folder + "data")
+    with open(folder + common.constants.config_file, "w") as f:
+        f.write("ROBOT = {0}\nMAX_TRIALS = {1}\nSTATUS = 2\nSYMMETRIC_CONTROLLER = YES\n".format(robot_id, trials))
+
+    fitness = np.cumsum(rng.uniform(0.0, 0.01, trials))
+    evolog = np.column_stack([fitness + 0.1, fitness, fitness - 0.1])
+    np.savetxt(folder + "evolution.log", evolog, fmt="%.6f")
+    np.savetxt(folder + common.constants.fitness_log, fitness, fmt="%.6f")
+    np.savetxt(folder + "population.log", rng.uniform(-1.0, 1.0, (10, 8)), fmt="%.6f")
+
+    columns = common.create_columns(robot_id)
+    data = rng.uniform(-1.0, 1.0, (episodes * steps, len(columns)))
+    data[:,0] = np.tile(np.arange(steps), episodes) # cycles restart every episode
+    fmt = ["%d"] + ["%.6f"] * (len(columns) - 1)
+    np.savetxt(folder + "data/" + common.constants.data_log, data, fmt=fmt)
+
+
+def generate_tree(path, robot_id, number, trials, episodes, steps):
+    """ creates number experiments of robot_id, unless they already exist """
+    robot = "robot{0}".format(robot_id)
+    name = "{0}{1}/{{0}}_{1}_bench/".format(path, robot)
+    rng = np.random.RandomState(0)
+    for i in range(number):
+        if not isfile(name.format(i) + "data/" + common.constants.data_log):
+            generate_experiment(name.format(i), robot_id, trials, episodes, steps, rng)
+    return robot, name
+
+
+class quiet:
+    """ silences the progress printing of the analysis functions """
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+
+    def __exit__(self, *args):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+
+def fresh_index(index_file, keep):
+    """ replaces the shared experiment index, cold if not keep,
+        which includes the settings cached by config """
+    if not keep:
+        if isfile(index_file):
+            os.unlink(index_file)
+        config.cache.clear()
+    expindex.the_index = expindex.ExperimentIndex(index_file)
+
+
+def measure(func, repeat, setup = None):
+    """ best time of func, setup runs untimed before each repetition """
+    times = []
+    for r in range(repeat):
+        with quiet():
+            if setup is not None:
+                setup()
+            start = default_timer()
+            func()
+            times.append(default_timer() - start)
+    return min(times)
+
+
+def run_all(path, robot_id, robot, name, number, repeat):
+    index_file = bench_path + "bench.index.json"
+    exp_path = path.rstrip("/")
+    first = name.format(0)
+    columns = common.create_columns(robot_id)
+    data_log = first + "data/" + common.constants.data_log
+
+    target = lambda: None
+    target.path = exp_path + "/" + robot
+    target.robot = robot
+    target.limit = None
+
+    def cold(func):
+        def run():
+            fresh_index(index_file, False)
+            func()
+        return run
+
+    def warm(func):
+        def run():
+            expindex.open_index().save()
+            fresh_index(index_file, True)
+            func()
+        return run
+
+    def drop_cache():
+        shutil.rmtree(data_log + results.cache_ending, ignore_errors=True)
+
+    def read_data_log():
+        results.read_data_log(data_log, columns)
+
+    def plot_evolog():
+        plot_evo_logs.prepare_figure()
+        plot_evo_logs.create_evolog(target, first)
+
+    cases = [ ("common.find_experiments cold", cold(lambda: common.find_experiments(exp_path, "")))
+            , ("common.find_experiments warm", warm(lambda: common.find_experiments(exp_path, "")))
+            , ("status.find_experiments cold", cold(lambda: status.find_experiments(exp_path, "", "")))
+            , ("status.find_experiments warm", warm(lambda: status.find_experiments(exp_path, "", "")))
+            , ("get_best_worst_median"       , warm(lambda: common.get_best_worst_median(name, range(number))))
+            , ("results.read_data_log cold"  , read_data_log)
+            , ("results.read_data_log warm"  , read_data_log)
+            , ("plot_evo_logs.create_evolog" , plot_evolog)
+            ]
+
+    setups = { "results.read_data_log cold": drop_cache
+             , "results.read_data_log warm": read_data_log # converts once, if needed
+             }
+
+    timings = {}
+    for label, func in cases:
+        timings[label] = measure(func, repeat, setups.get(label))
+        print("{0:32} {1:9.4f} s".format(label, timings[label]))
+    return timings
+
+
+def get_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"]).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def load_previous(scale):
+    """ timings of the last run with the same scale or None """
+    previous = None
+    if isfile(result_log):
+        with open(result_log) as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry["scale"] == scale:
+                    previous = entry
+    return previous
+
+
+def compare(timings, previous):
+    if previous is None:
+        return
+    print("\ncompared to {0} ({1}):".format(previous["revision"], previous["date"]))
+    for label in sorted(timings.keys()):
+        if label in previous["timings"] and previous["timings"][label] > 0:
+            ratio = timings[label] / previous["timings"][label]
+            print("{0:32} {1:7.2f}x {2}".format(label, ratio, "SLOWER" if ratio > 1.2 else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--robot'   , default=31, type=int, help="robot id, defines the columns of data.log")
+    parser.add_argument('-n', '--number'  , default=10, type=int, help="number of experiments")
+    parser.add_argument('-t', '--trials'  , default=10000, type=int)
+    parser.add_argument('-e', '--episodes', default=5, type=int, help="episodes in data.log")
+    parser.add_argument('-s', '--steps'   , default=1000, type=int, help="steps per episode")
+    parser.add_argument('-x', '--repeat'  , default=3, type=int, help="best of x runs")
+    parser.add_argument('-p', '--path'    , default=bench_path+"exp/")
+    parser.add_argument('-c', '--clean'   , action='store_true', help="remove the synthetic tree afterwards")
+    args = parser.parse_args()
+
+    if args.robot not in common.constants.num_joints:
+        print("Error: unknown robot id {0}".format(args.robot))
+        return
+
+    scale = { "robot": args.robot, "number": args.number, "trials": args.trials
+            , "episodes": args.episodes, "steps": args.steps }
+
+    print("Generating synthetic experiments in {0}".format(args.path))
+    with quiet():
+        robot, name = generate_tree(args.path, args.robot, args.number, args.trials, args.episodes, args.steps)
+
+    print("Timing analysis paths, best of {0}:".format(args.repeat))
+    timings = run_all(args.path, args.robot, robot, name, args.number, args.repeat)
+
+    compare(timings, load_previous(scale))
+    common.create_folder(bench_path)
+    with open(result_log, "a") as f:
+        f.write(json.dumps({ "date": time.strftime("%Y-%m-%d %H:%M:%S"), "revision": get_revision()
+                           , "scale": scale, "timings": timings }) + "\n")
+    print("Results appended to {0}".format(result_log))
+
+    if args.clean:
+        shutil.rmtree(args.path)
+    print("\n____\nDONE.\n")
+
+
+if __name__ == "__main__": main()
@@ -1,13 +1,25 @@
 """ commonly used functions for 
     evaluating recorded experiments
 """
-import re, shlex
+import re, sys, shlex, errno
 from subprocess import Popen, PIPE
-from os import listdir, makedirs
-from os.path import isfile, isdir, join, exists
-from time import sleep
+from threading import Thread, Lock
+from os import makedirs, setsid
+from os.path import isdir
+from expindex import open_index
+from config import get_value
+from logs import count_lines, tail, LogFollower, read_log, read_chunks, get_stamp, write_atomic
+
+ansi_escape = re.compile(r'\x1b[^m]*m')
+print_lock = Lock()
+
+
+def report(msg):
+    """ prints whole lines from concurrent threads """
+    with print_lock:
+        print(msg)
+        sys.stdout.flush()
 
-import pandas as pd
 
 class constants:
     config_file = "evolution.conf"
@@ -88,42 +100,35 @@ def create_columns(robot_id):
 
 
 def create_folder(folder):
-    if not exists(folder):
+    """ creates folder with its parents, if another process was faster
+        meanwhile, that is fine """
+    try:
         makedirs(folder)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
 
 
 def is_experiment(path):
-    return isdir(path) \
-        and isfile(path+"/"+constants.config_file)
+    return open_index().get(path) is not None
 
 
 def is_completed(path):
-    conf = path+"/"+constants.config_file
-    with open(conf) as f:
-        data = f.read()
-    m = re.search("STATUS = (\d+)", data)
-    if m:
-        return 2 == int(m.groups()[0])
-    print("ERROR: Did not find status entry in {0}".format(conf))
-    return False
+    entry = open_index().get(path)
+    if entry is None:
+        return False
+    if entry["status"] < 0:
+        print("ERROR: Did not find status entry in {0}/{1}".format(path, constants.config_file))
+    return 2 == entry["status"]
 
 
 def get_robot_id(path):
     conf = path.rstrip('/') + "/" +constants.config_file
-    with open(conf) as f:
-        data = f.read()
-    m = re.search("ROBOT = (\d+)", data)
-    if m:
-        id = int(m.groups()[0])
-        #print("Robot ID is: {}".format(id))
-        return id
-    else:
-        print("ERROR: Did not find robot entry in {0}".format(conf))
-        return 0
+    return get_value(conf, "ROBOT", 0)
 
 
 def get_experiments(target):
-    return ["{0}/{1}/".format(target.path, d) for d in sorted(listdir(target.path)) if isdir(join(target.path, d))]
+    return ["{0}/{1}/".format(target.path, d) for d in open_index().subdirs(target.path)]
 
 
 # returns dictionary
@@ -142,14 +147,7 @@ def group_experiments(target):
 
 
 def get_max_trials(folder):
-    setting = folder+constants.config_file
-    with open(setting, 'r') as f:
-        for line in f.readlines():
-            m = re.search("^MAX_TRIALS = (\d+)$", line)
-            if m:
-                return int(m.groups()[0])
-    print("WARNING: No max trials defined in file: {}".format(setting))
-    return 0
+    return get_value(folder+constants.config_file, "MAX_TRIALS", 0)
 
 
 def get_best_worst_median(name, index_list):
@@ -157,9 +155,8 @@ def get_best_worst_median(name, index_list):
     fitlist = []
     for i in index_list:
         print("reading "+name.format(i)),
-        filename = name.format(i) + constants.fitness_log
-        fitness = pd.read_csv(filename, sep=' ', header=None)
-        sumfit = sum(fitness[0])
+        entry = open_index().get(name.format(i))
+        sumfit = entry["fitness"]["sum"] if entry else 0.0
         fitlist.append((sumfit,i))
         print(" fitness: {0}".format(sumfit))
 
@@ -172,31 +169,51 @@ def get_best_worst_median(name, index_list):
     return (best, median, worst)
 
 
-def execute_command(command):
+def stream_to_file(pipe, filename, max_line = 1<<16):
+    with open(filename, "w") as f:
+        for line in iter(lambda: pipe.readline(max_line), b''):
+            f.write(ansi_escape.sub('', line))
+            f.flush()
+    pipe.close()
+
+
+def execute_logged(command, output_path, on_start = None, new_session = False):
+    """ runs the command and streams its stdout and stderr,
+        stripped from ansi escape codes, into the output path
+        while it is running. returns the exit code.
+        on_start gets the process, with new_session the process
+        gets its own group, so it can be stopped with all children.
+    """
+    create_folder(output_path)
     args = shlex.split(command)
-    print(' '.join(args))
-    proc = Popen(args, stdout=PIPE, stderr=PIPE)
-    while proc.poll() is None:
-        sleep(1)
-        print("."),
-    out, err = proc.communicate()
-    exitcode = proc.returncode
-    return exitcode, out, err
+    proc = Popen(args, stdout=PIPE, stderr=PIPE, preexec_fn=setsid if new_session else None)
+    if on_start is not None:
+        on_start(proc)
+    readers = [ Thread(target=stream_to_file, args=(proc.stdout, output_path+"stdout.txt"))
+              , Thread(target=stream_to_file, args=(proc.stderr, output_path+"stderr.txt"))
+              ]
+    for r in readers:
+        r.daemon = True
+        r.start()
+    exitcode = proc.wait()
+    for r in readers:
+        r.join()
+    return exitcode
 
 
 def is_recorded(path):
-    return isfile(path+"/data/"+constants.data_log)
+    entry = open_index().get(path)
+    return entry is not None and entry["recorded"]
 
 
 def find_experiments(path, filt, dir_level = 0, find_recorded_only = True):
     exp_list = []
     number = 0
     try:
-        dirs = [d for d in listdir(path) if isdir(path+"/"+d)]
+        dirs = open_index().subdirs(path)
     except:
         print("Error while scanning folders.")
         return [] # empty
-    dirs.sort()
     for d in dirs:
         exp_path = path+"/"+d
         if not is_experiment(exp_path):
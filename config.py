@@ -0,0 +1,49 @@
+""" parser for evolution.conf and .setting files
+    --------------------------------------------
+    reads a file of 'KEY = VALUE' lines once into a dict of typed
+    values (int, float, YES/NO as bool, otherwise str). parsed files
+    are cached by path, mtime and size, so looking up several keys
+    or scanning many experiments costs one read per changed file.
+"""
+import re, os
+
+entry = re.compile(r"^(\w+) = (.*?)\s*$", re.M)
+cache = {}
+
+
+def to_value(s):
+    for convert in [int, float]:
+        try:
+            return convert(s)
+        except ValueError:
+            pass
+    if s in ["YES", "NO"]:
+        return s == "YES"
+    return s
+
+
+def parse(text):
+    return { key: to_value(value) for key, value in entry.findall(text) }
+
+
+def read_config(filename):
+    """ returns the typed dict of filename, raises if it does not exist """
+    st = os.stat(filename)
+    key = os.path.abspath(filename)
+    stamp = (st.st_mtime, st.st_size)
+    cached = cache.get(key)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    with open(filename) as f:
+        conf = parse(f.read())
+    cache[key] = (stamp, conf)
+    return conf
+
+
+def get_value(filename, name, default = None):
+    """ single value of filename, prints an error if it is missing """
+    conf = read_config(filename)
+    if name not in conf:
+        print("ERROR: Did not find {0} entry in {1}".format(name, filename))
+        return default
+    return conf[name]
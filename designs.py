@@ -0,0 +1,112 @@
+""" sampling designs for parameter sweeps
+    ------------------------------------
+    a parameter is given as 'KEY:lo:hi[:log][:int]' or 'KEY:value'.
+    designs map points of the unit cube onto the parameter ranges:
+        + grid  : cartesian product of 'number' values per parameter
+        + lhs   : latin hypercube, one sample per stratum and parameter
+        + sobol : sobol low-discrepancy sequence
+    every design returns a list of points, a point is a list of
+    (key, value) pairs in the order of the parameters.
+"""
+import itertools
+import numpy as np
+
+# direction numbers (s, a, m) for dimensions 2..10 from joe & kuo (2008)
+sobol_directions = [ (1, 0, [1])
+                   , (2, 1, [1, 3])
+                   , (3, 1, [1, 3, 1])
+                   , (3, 2, [1, 1, 1])
+                   , (4, 1, [1, 1, 3, 3])
+                   , (4, 4, [1, 3, 5, 13])
+                   , (5, 2, [1, 1, 5, 5, 17])
+                   , (5, 4, [1, 1, 5, 5, 5])
+                   , (5, 7, [1, 1, 7, 11, 19])
+                   ]
+sobol_bits = 30
+
+
+class Param:
+    def __init__(self, text):
+        fields = text.split(":")
+        self.key = fields[0]
+        flags = [f for f in fields[1:] if f in ["log", "int"]]
+        values = [float(f) for f in fields[1:] if f not in flags]
+        if len(values) not in [1, 2]:
+            raise ValueError("Parameter must be KEY:lo:hi[:log][:int] or KEY:value, got: {0}".format(text))
+        self.lo = values[0]
+        self.hi = values[-1]
+        self.log = "log" in flags
+        self.int = "int" in flags
+        if self.log and self.lo <= 0:
+            raise ValueError("Log scale needs positive bounds: {0}".format(text))
+
+    def is_fixed(self):
+        return self.lo == self.hi
+
+    def scale(self, u):
+        """ maps u in [0,1] onto the range of the parameter """
+        if self.log:
+            value = np.exp(np.log(self.lo) + u * (np.log(self.hi) - np.log(self.lo)))
+        else:
+            value = self.lo + u * (self.hi - self.lo)
+        return int(round(value)) if self.int else round(float(value), 10)
+
+
+def latin_hypercube(n, dim, rng):
+    """ n samples, every parameter range is cut into n strata,
+        each stratum is hit exactly once """
+    u = np.empty((n, dim))
+    for d in range(dim):
+        u[:,d] = (rng.permutation(n) + rng.uniform(size=n)) / n
+    return u
+
+
+def sobol(n, dim):
+    """ first n points of the sobol sequence, starting with 0 """
+    if dim > len(sobol_directions) + 1:
+        raise ValueError("Sobol design supports up to {0} parameters.".format(len(sobol_directions)+1))
+    V = np.zeros((dim, sobol_bits), dtype=np.int64)
+    V[0,:] = [1 << (sobol_bits-1-k) for k in range(sobol_bits)]
+    for d in range(1, dim):
+        s, a, m = sobol_directions[d-1]
+        for k in range(sobol_bits):
+            if k < s:
+                V[d,k] = m[k] << (sobol_bits-1-k)
+            else:
+                V[d,k] = V[d,k-s] ^ (V[d,k-s] >> s)
+                for j in range(1, s):
+                    if (a >> (s-1-j)) & 1:
+                        V[d,k] ^= V[d,k-j]
+    u = np.zeros((n, dim))
+    x = np.zeros(dim, dtype=np.int64)
+    for i in range(1, n):
+        c = 0 # position of the lowest zero bit of i-1 (gray code)
+        while (i-1) >> c & 1:
+            c += 1
+        x ^= V[:,c]
+        u[i,:] = x / float(1 << sobol_bits)
+    return u
+
+
+def create_points(params, u):
+    """ maps the rows of u onto the free parameters """
+    free = [p for p in params if not p.is_fixed()]
+    points = []
+    for row in u:
+        values = dict(zip([p.key for p in free], row))
+        points.append([(p.key, p.scale(values[p.key]) if not p.is_fixed() else p.scale(0.0)) for p in params])
+    return points
+
+
+def create_design(params, design, budget = 0, number = 0, seed = None):
+    free = len([p for p in params if not p.is_fixed()])
+    if design == "grid":
+        axis = np.linspace(0.0, 1.0, num=number) if number > 1 else np.zeros(1)
+        u = list(itertools.product(axis, repeat=free))
+    elif design == "lhs":
+        u = latin_hypercube(budget, free, np.random.RandomState(seed))
+    elif design == "sobol":
+        u = sobol(budget, free)
+    else:
+        raise ValueError("Unknown design: {0}".format(design))
+    return create_points(params, u)
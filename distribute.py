@@ -5,54 +5,84 @@
 # sudo apt-get install libffi6, libffi-dev, python2.7-dev, libssl-dev
 # sudo pip install cryptography --force-reinstall
 
-import re, sys, shlex, argparse, getpass, paramiko, time
-from subprocess import Popen, PIPE
-from os import listdir
-from os.path import isfile, isdir, join
+import sys, argparse, getpass
+from multiprocessing.pool import ThreadPool
+from processes import Host, get_status, server_list
+from evolution import get_available_experiments
 
 data_path   = "../data/exp/"
 
-# consider using 'nproc', to determine the number of usable cores
-host_domain = ".informatik.hu-berlin.de"
-#               servername cores
-server_list = [ ("gruenau1",  16)
-              , ("gruenau2",  16)
-              , ("gruenau3",  32)
-              , ("gruenau4",  32)
-              , ("gruenau5", 120)
-              , ("gruenau6", 120)
-              , ("gruenau7", 120)
-              , ("gruenau8", 120)
-              ]
+# one script per host, the home directory is shared between the servers
+execute_commands = ["echo 'cd work/diss/evolution; nohup ./evolution.py -r {0} -n {1} -x -j {3} &' > run_{2}.sh", "bash run_{2}.sh </dev/null >&/dev/null" ]
 
-execute_commands = ["echo 'cd work/diss/evolution; nohup ./evolution.py -r {0} -n {1} -x &' > run.sh", "bash run.sh </dev/null >&/dev/null" ]
+def get_free_cores(status):
+    """ cores neither busy by load nor by running simloid instances """
+    busy = max(int(round(status["load"])), status["simloid"])
+    return max(0, status["cores"] - busy)
 
-def start_experiment(server, robot, num, user, pswd, mul):
-    print("Connecting to: {0}".format(server)),
 
+def place_jobs(states, num_jobs):
+    """ fills the free cores of the hosts, largest gaps first.
+        returns list of (host index, number of workers) """
+    free = [(get_free_cores(s), i) for i,s in enumerate(states) if "error" not in s]
+    free.sort(reverse=True)
+    placement = []
+    for cores, i in free:
+        if num_jobs <= 0 or cores == 0:
+            break
+        workers = min(cores, num_jobs)
+        placement.append((i, workers))
+        num_jobs -= workers
+    return placement
+
+
+def start_experiment(host, robot, num, workers):
+    """ starts one launcher with the given number of workers """
     try:
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.connect(server, username=user, password=pswd, timeout=10)
-        print("SUCCESS. Starting {0} instances: ".format(mul)),
-        for i in range(mul):
-            for cmd in execute_commands:
-                stdin, stdout, stderr = ssh.exec_command(cmd.format(robot, num))
-                lines = stdout.readlines() + stderr.readlines()
-                for line in lines:
-                    print(line)
-            print("/"),
-            time.sleep(3)
-        ssh.close()
-        print("DONE.")
-    except:
-        print("FAILED.")
-
-
-def start_all(server_list, robot, num, user, pswd, mul):
-    server_list.sort(key=lambda tup: tup[1], reverse=True)
-    for server,_ in server_list:
-        start_experiment(server+host_domain, robot, num, user, pswd, mul)
+        messages = []
+        for cmd in execute_commands:
+            messages += host.execute(cmd.format(robot, num, host.name, workers))
+        return True, messages
+    except Exception as e:
+        return False, ["FAILED: {0}".format(e)]
+
+
+def start_all(hosts, robot, num, num_jobs, dry):
+    pool = ThreadPool(len(hosts))
+    print("Measuring load of {0} servers.".format(len(hosts)))
+    states = pool.map_async(get_status, hosts).get(0xFFFF)
+
+    placement = place_jobs(states, num_jobs)
+    for host, s in zip(hosts, states):
+        if "error" in s:
+            print("{0:10} FAILED: {1}".format(host.name, s["error"]))
+        else:
+            print("{0:10} {1:3d} cores, load {2:6.2f}, {3:3d} simloids -> {4:3d} free"
+                  .format(host.name, s["cores"], s["load"], s["simloid"], get_free_cores(s)))
+
+    print("\nPlacing {0} jobs:".format(num_jobs))
+    for i, workers in placement:
+        print("{0:10} {1:3d} workers".format(hosts[i].name, workers))
+    placed = sum(workers for _,workers in placement)
+    if not placement:
+        print("ERROR: no free cores on any host, nothing started.")
+    elif placed < num_jobs:
+        print("WARNING: only {0} free cores, the remaining jobs are picked up when workers finish.".format(placed))
+
+    if dry or not placement:
+        pool.close()
+        return placed
+
+    start = lambda p: start_experiment(hosts[p[0]], robot, num, p[1])
+    results = pool.map_async(start, placement).get(0xFFFF)
+    pool.close()
+
+    print("")
+    for (i, workers), (ok, messages) in zip(placement, results):
+        print("{0:10} {1}".format(hosts[i].name, "DONE." if ok else "FAILED."))
+        for line in messages:
+            print("    {0}".format(line.rstrip()))
+    return sum(workers for (_,workers),(ok,_) in zip(placement, results) if ok)
 
 
 def main():
@@ -61,7 +91,7 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-r', '--robot'    , default = "")
     parser.add_argument('-n', '--number'   , default = 0 )
-    parser.add_argument('-i', '--instances', default = 1 )
+    parser.add_argument('-d', '--dry'      , action = 'store_true')
     args = parser.parse_args()
 
     robot = str(args.robot)
@@ -74,13 +104,11 @@ def main():
         print("Number of experiments not specified.")
         return
 
-    mul = int(args.instances)
-    if mul > 16:
-        print("too many instances.")
-        return
+    num_jobs = num_exp * len(get_available_experiments(robot))
 
     print("selected robot is: {0}".format(robot))
     print("number of experiments: {0}.".format(num_exp))
+    print("number of jobs: {0}.".format(num_jobs))
 
     user = raw_input("Username: ")
     if user == "":
@@ -89,8 +117,13 @@ def main():
 
     pswd = getpass.getpass()
 
-    start_all(server_list, robot, num_exp, user, pswd, mul)
+    hosts = [Host(server, user, pswd) for server in server_list]
+    started = start_all(hosts, robot, num_exp, num_jobs, args.dry)
+    for host in hosts:
+        host.close()
     print("\n____\nDONE distributing.")
+    if started == 0:
+        sys.exit(1)
 
 if __name__ == "__main__": main()
 
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+""" episodes
+    --------
+    summarizes every episode of recorded experiments. episodes are
+    found by the resets of the cycles column to 0, all summaries are
+    computed at once per experiment with ufunc.reduceat:
+        + mean of norm_power and avg_vel_fw
+        + final avg_pos_y
+        + range (max - min) of each joint angle
+    writes one table per experiment next to its data.log and one
+    table across all experiments. tables are reused until data.log
+    changes, which is told by the stamp (mtime and size) of data.log
+    stored next to the table.
+    e.g. ./episodes.py -p ../data/exp/ -f 0fw
+"""
+
+import re, json, argparse
+import numpy as np
+import pandas as pd
+
+from common import *
+from results import read_data_log
+
+table_name = "episodes.csv"
+mean_cols  = ["norm_power", "avg_vel_fw"]
+final_cols = ["avg_pos_y"]
+
+
+def get_joint_cols(columns):
+    return [c for c in columns if re.match(r"p\d+$", c)]
+
+
+def get_table_cols(joint_cols):
+    return ["episode", "steps"] + ["mean_" + c for c in mean_cols] \
+         + ["final_" + c for c in final_cols] + ["range_" + c for c in joint_cols]
+
+
+def aggregate(data, joint_cols):
+    """ one row per episode of data (a DataFrame with cycles column) """
+    cycles = data["cycles"].values
+    starts = np.where(cycles == 0)[0]
+    if len(starts) == 0:
+        # with header, so the cached table can be read back
+        return pd.DataFrame(columns=get_table_cols(joint_cols))
+    n = len(cycles)
+    idx = starts - starts[0] # rows before the first reset are no episode
+    rows = slice(starts[0], n)
+    lengths = np.diff(np.append(starts, n))
+    ends = np.append(starts[1:], n) - 1
+
+    table = pd.DataFrame({"episode": np.arange(len(starts)), "steps": lengths})
+    means = np.add.reduceat(data[mean_cols].values[rows], idx, axis=0) / lengths[:, None]
+    for i, c in enumerate(mean_cols):
+        table["mean_" + c] = means[:, i]
+    for c in final_cols:
+        table["final_" + c] = data[c].values[ends]
+    joints = data[joint_cols].values[rows]
+    ranges = np.maximum.reduceat(joints, idx, axis=0) - np.minimum.reduceat(joints, idx, axis=0)
+    for i, c in enumerate(joint_cols):
+        table["range_" + c] = ranges[:, i]
+    return table
+
+
+def is_table_valid(cached, stamp):
+    try:
+        with open(cached + ".json") as f:
+            return json.load(f)["stamp"] == stamp
+    except (IOError, ValueError, KeyError):
+        return False
+
+
+def summarize_experiment(expname):
+    """ episode table of an experiment, cached next to data.log """
+    folder = expname.rstrip("/") + "/data/"
+    cached = folder + table_name
+    stamp = get_stamp(folder + constants.data_log)
+    if is_table_valid(cached, stamp):
+        return pd.read_csv(cached)
+
+    columns = create_columns(get_robot_id(expname))
+    joint_cols = get_joint_cols(columns)
+    data = read_data_log(folder + constants.data_log, columns, ["cycles"] + mean_cols + final_cols + joint_cols)
+    table = aggregate(data, joint_cols)
+    table.to_csv(cached, index=False)
+    # the stamp is written last, an interrupted table is never valid
+    write_atomic(cached + ".json", json.dumps({"stamp": stamp}))
+    return table
+
+
+def summarize_all(experiments):
+    """ episode tables of all experiments in one, None if none has episodes """
+    tables = []
+    for e in experiments:
+        table = summarize_experiment(e)
+        if table.empty:
+            print("no episodes in {0}, skipped.".format(e))
+            continue
+        table.insert(0, "experiment", e.rstrip("/").split("/")[-1])
+        tables.append(table)
+    return pd.concat(tables, ignore_index=True, sort=False) if tables else None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--filter' , default='')
+    parser.add_argument('-p', '--path'   , default=constants.exp_dir)
+    args = parser.parse_args()
+
+    experiments = get_all_experiments(args.path, args.filter, recorded_only=True)
+    if len(experiments) > 0:
+        table = summarize_all(experiments)
+        if table is not None:
+            filename = args.path.rstrip("/") + "/" + table_name
+            table.to_csv(filename, index=False)
+            print("{0} episodes of {1} experiments written to {2}".format(len(table), table["experiment"].nunique(), filename))
+        else:
+            print("No episodes found.")
+
+    print("____\nDONE.")
+
+if __name__ == "__main__": main()
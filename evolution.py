@@ -1,15 +1,22 @@
 #!/usr/bin/python
 
-import re, sys, shlex, argparse
-from subprocess import Popen, PIPE
+import argparse, threading, hashlib, random, time
+from multiprocessing import cpu_count
+from Queue import PriorityQueue
 from os import listdir, makedirs, unlink
 from os.path import isfile, isdir, join, getmtime, exists
 from math import ceil
+from ports import leased_port
+import jobs
+from config import read_config, get_value
+from common import execute_logged, report, write_atomic
 
 passphr         = "start"
 port_start      = 8000
 do_quit         = 0
 num_conductions = 1
+retry_failed    = False
+poll_interval   = 30.0 # seconds between looking for stale claims in worker mode
 
 nice = 19
 binary = "./bin/Release/evolution"
@@ -18,8 +25,6 @@ conf_file = "evolution.conf"
 settings_folder = "./settings/"
 settings_file_ending = ".setting"
 tournament_prefix = "tournament/tmt_"
-ansi_escape = re.compile(r'\x1b[^m]*m')
-
 def get_available_experiments(robot):
 	settings_path = settings_folder + robot
 	if not isdir(settings_path):
@@ -36,21 +41,38 @@ def check_binary():
 	else:
 		print("Could not find evolution binary {0}".format(binary))
 
-def is_up_to_date(tournament, expfolderlist):
+def get_digest(filename):
+	md5 = hashlib.md5()
+	with open(filename, 'rb') as f:
+		for block in iter(lambda: f.read(1<<20), b''):
+			md5.update(block)
+	return md5.hexdigest()
+
+def get_source_digests(expfolderlist):
+	return ["{0} {1}".format(get_digest(data_path+e+"/population.log"), e) for e in expfolderlist]
+
+def get_tournament_source(robot, experiment):
+	return data_path+robot+"/tournament/{0}".format(experiment)
+
+def is_up_to_date(robot, experiment, expfolderlist):
+	""" compares the contents of the input population files with the
+	    digests stored when the tournament population was created """
+	source = get_tournament_source(robot, experiment)
+	if not is_completed(["{0}/T_{0}_{1}".format(robot, experiment)]):
+		return False # failed or interrupted
+	if isfile(source+".md5"):
+		with open(source+".md5") as f:
+			return f.read().splitlines() == get_source_digests(expfolderlist)
+	# no digests stored yet, fall back to the population file's mtime
+	if not isfile(source+".log"):
+		return False
 	for e in expfolderlist:
-		if getmtime(data_path+e) > getmtime(data_path+tournament):
+		if getmtime(data_path+e+"/population.log") > getmtime(source+".log"):
 			return False
 	return True
 
 def get_popsize(setting):
-	with open(setting, 'r') as f:
-		for line in f.readlines():
-			m = re.search("^POPULATION_SIZE = (\d+)$", line)
-			if m:
-				#print("\tPOPSIZE = {}".format(m.groups()[0]))
-				return int(m.groups()[0])
-	print("WARNING: No popsize defined in file: {}".format(setting))
-	return 0
+	return get_value(setting, "POPULATION_SIZE", 0)
 
 def create_population_from(expfolderlist, popsize):
 	#print("\tCreate tournament population from {} experiments.".format(len(expfolderlist)))
@@ -64,13 +86,6 @@ def create_population_from(expfolderlist, popsize):
 	assert len(poplist) >= popsize, "poplist {0} {1}".format(len(poplist), popsize)
 	return poplist[0:popsize]
 
-def execute_command(command):
-	args = shlex.split(command)
-	proc = Popen(args, stdout=PIPE, stderr=PIPE)
-	out, err = proc.communicate()
-	exitcode = proc.returncode
-	return exitcode, out, err
-
 def clean_folder(folder):
 	print("\tCleaning folder: {}".format(folder))
 	for f in listdir(folder):
@@ -80,143 +95,362 @@ def clean_folder(folder):
 			unlink(file_path)
 		#elif isdir(file_path): shutil.rmtree(file_path)
 
-def conduct(robot, experiment, port, num, dry):
+def has_stale_marker(expname, job = None):
+	""" a result marker without the data, e.g. the folder was
+	    deleted to rerun the experiment. is_completed() is False.
+	    job defaults to expname, tournaments have jobs of their own. """
+	state = jobs.get_state(job or expname)
+	return state == "done" or (state == "failed" and not isdir(data_path+expname))
+
+def get_job_state(expname, dry):
+	""" job state of an incomplete experiment, stale markers are dropped """
+	if has_stale_marker(expname):
+		if dry:
+			return "open"
+		jobs.forget(expname)
+	return jobs.get_state(expname)
+
+def conduct(robot, experiment, num, dry):
 	setting = "{0}{1}/{2}{3}".format(settings_folder, robot, experiment, settings_file_ending)
 	expname = "{0}/{2}_{0}_{1}".format(robot, experiment, num)
-	command = "nice -n {4} {0} -n {1} -s {2} -p {3} -b"\
-		.format(binary, expname, setting, port, nice)
 
-	if isdir(data_path+expname):
-		print(" + {0} DONE. SKIPPED.".format(expname))
-		return
-	else:
-		print(" > {0}".format(expname)),
+	if is_completed([expname]):
+		report(" + {0} DONE. SKIPPED.".format(expname))
+		return expname, None
 
-	if not exists(data_path+robot):
-		makedirs(data_path+robot)
+	state = get_job_state(expname, dry)
+	if dry:
+		if state in ["open", "dead"]:
+			report(" > {0} nice -n {4} {1} -n {0} -s {2} -p {3} -b".format(expname, binary, setting, "<port>", nice))
+		else:
+			report(" + {0} {1}. SKIPPED.".format(expname, state.upper()))
+		return expname, None
 
-	if not dry:
+	if not jobs.claim(expname, retry_failed):
+		report(" + {0} {1}. SKIPPED.".format(expname, jobs.get_state(expname).upper()))
+		return expname, None
+
+	try:
 		output_path = "{0}{1}/".format(data_path, expname)
-		exitcode, out, err = execute_command(command)
-		with open(output_path + "stdout.txt", "w") as out_file:
-			out_file.write(ansi_escape.sub('', out))
-		with open(output_path + "stderr.txt", "w") as err_file:
-			err_file.write(ansi_escape.sub('', err))
-		print "OK." if exitcode==0 else "FAILED. Code {0}".format(exitcode)
-	else:
-		print(command)
+		if isdir(output_path):
+			report(" + {0} INCOMPLETE -> RESTARTING.".format(expname))
+			clean_folder(output_path)
+
+		with leased_port(port_start) as port, jobs.Heartbeat(expname):
+			command = "nice -n {4} {0} -n {1} -s {2} -p {3} -b"\
+				.format(binary, expname, setting, port, nice)
+			report(" > {0} (port {1})".format(expname, port))
+			exitcode = execute_logged(command, output_path)
+	except:
+		jobs.release(expname)
+		raise
+
+	jobs.finish(expname, exitcode)
+	report(" < {0} {1}".format(expname, "OK." if exitcode==0 else "FAILED. Code {0}".format(exitcode)))
+	return expname, exitcode
+
+class Executor:
+	""" runs jobs on a number of worker threads, jobs of lower
+	    priority value are taken first. jobs may submit new jobs
+	    by means of the 'then' callback, which gets the result. """
+	def __init__(self, workers):
+		self.queue   = PriorityQueue()
+		self.cond    = threading.Condition()
+		self.pending = 0
+		self.count   = 0
+		self.results = []
+		for i in range(workers):
+			t = threading.Thread(target=self.worker)
+			t.daemon = True
+			t.start()
+
+	def submit(self, priority, func, args, then = None):
+		with self.cond:
+			self.pending += 1
+			self.count += 1
+			self.queue.put((priority, self.count, func, args, then))
+
+	def worker(self):
+		while True:
+			_, _, func, args, then = self.queue.get()
+			try:
+				result = func(*args)
+			except Exception as e:
+				report(" ! {0}{1} raised: {2}".format(func.__name__, args, e))
+				result = ("{0}{1}".format(func.__name__, args), -1)
+			with self.cond:
+				self.results.append(result)
+			try:
+				if then is not None:
+					then(result)
+			finally:
+				with self.cond:
+					self.pending -= 1
+					self.cond.notify_all()
+
+	def wait(self):
+		with self.cond:
+			while self.pending > 0:
+				self.cond.wait(1.0) # timeout keeps Ctrl-C working
+
+def schedule_all(executor, robot, experiments, num, dry):
+	""" the jobs form a small dag: the tournament of an experiment
+	    is started as soon as all its repetitions are finished. """
+	if not exists(data_path+robot):
+		makedirs(data_path+robot)
 
-def conduct_all(robot, experiments, port, num, dry):
 	for e in experiments:
-		conduct(robot, e, port, num, dry)
-		port += 1
-	return port
+		remaining = [num]
+		def repetition_done(result, e = e, remaining = remaining):
+			with executor.cond:
+				remaining[0] -= 1
+				ready = (remaining[0] == 0)
+			if ready:
+				executor.submit(0, start_tournament, (robot, e, num, dry))
+
+		for n in range(num):
+			executor.submit(1, conduct, (robot, e, n, dry), then=repetition_done)
+
+def enqueue_all(robot, experiments, num, dry):
+	""" puts every repetition and tournament into the shared queue for
+	    the workers, a tournament waits there for its repetitions """
+	for e in experiments:
+		for n in range(num):
+			expname = "{0}/{2}_{0}_{1}".format(robot, e, n)
+			report(" > {0} {1}".format(expname, "QUEUED." if not dry else ""))
+			if not dry:
+				jobs.enqueue(expname, {"robot": robot, "experiment": e, "num": n, "repetitions": num})
+		tournament = "{0}/T_{0}_{1}".format(robot, e)
+		report(" > {0} {1}".format(tournament, "QUEUED." if not dry else ""))
+		if not dry:
+			jobs.enqueue(tournament, {"robot": robot, "experiment": e, "repetitions": num, "tournament": True})
+
+def is_runnable(state):
+	return state in ["open", "dead"] or (state == "failed" and retry_failed)
+
+def get_tournament_state(robot, experiment, num, queued):
+	""" "waiting" while repetitions of the tournament are queued, "blocked"
+	    if they are not and some did not complete or there is no setting,
+	    "done" if it is up to date, else the state of the job for the
+	    current input populations """
+	if not isfile(get_tournament_setting(robot, experiment)):
+		return "blocked"
+	expfolderlist = ["{0}/{2}_{0}_{1}".format(robot, experiment, n) for n in range(num)]
+	if not is_completed(expfolderlist):
+		return "waiting" if any(e in queued for e in expfolderlist) else "blocked"
+	tournament = "{0}/T_{0}_{1}".format(robot, experiment)
+	if isdir(data_path+tournament) and is_up_to_date(robot, experiment, expfolderlist):
+		return "done"
+	job = get_tournament_job(tournament, get_source_digests(expfolderlist))
+	return "open" if has_stale_marker(tournament, job) else jobs.get_state(job)
+
+def pull_jobs(results):
+	""" worker loop: claims and runs single queued jobs until the queue
+	    is empty. jobs claimed by other workers are polled, since their
+	    claim may go stale and the job has to be taken over. tournaments
+	    stay queued until their repetitions are finished. """
+	while True:
+		queued = jobs.get_queued()
+		if not queued:
+			return
+		random.shuffle(queued) # less contention between the workers
+		names = set(job for job, p in queued)
+		runnable = False
+		for job, p in queued:
+			robot, experiment = str(p["robot"]), str(p["experiment"])
+			if p.get("tournament"):
+				state = get_tournament_state(robot, experiment, p["repetitions"], names)
+				if state == "blocked":
+					report(" ! {0} NOT READY OR NOT AVAILABLE -> DROPPED.".format(job))
+				if state in ["done", "blocked"] or (state == "failed" and not is_runnable(state)):
+					jobs.dequeue(job)
+					continue
+				if not is_runnable(state):
+					continue # waiting for repetitions or run by another worker
+				runnable = True
+				tournament = start_tournament(robot, experiment, p["repetitions"], False)
+				if tournament[1] is not None:
+					results.append(tournament)
+				break # the next pass dequeues it when done
+			state = get_job_state(job, False) if not is_completed([job]) else jobs.get_state(job)
+			if state in ["done", "failed"] and not is_runnable(state):
+				jobs.dequeue(job)
+				continue
+			if not is_runnable(state):
+				continue
+			runnable = True
+			result = conduct(robot, experiment, p["num"], False)
+			if result[1] is None and jobs.get_state(job) == "claimed":
+				continue # another worker was faster
+			jobs.dequeue(job)
+			if result[1] is not None:
+				results.append(result)
+			break # re-read the queue, other workers have changed it meanwhile
+		if not runnable:
+			time.sleep(poll_interval)
+
+def work(workers, dry):
+	queued = jobs.get_queued()
+	print("{0} jobs in queue {1}".format(len(queued), jobs.queue_path))
+	if dry:
+		for job, _ in sorted(queued):
+			print(" {0} {1}".format(job, jobs.get_state(job).upper()))
+		return []
+	results = []
+	threads = [threading.Thread(target=pull_jobs, args=(results,)) for i in range(workers)]
+	for t in threads:
+		t.daemon = True
+		t.start()
+	while any(t.is_alive() for t in threads):
+		time.sleep(1.0) # keeps Ctrl-C working
+	return results
+
+def print_summary(results):
+	failed = [(e, c) for e, c in results if c not in (None, 0)]
+	finished = [e for e, c in results if c == 0]
+	print("\nFinished {0}, failed {1}, skipped {2}.".format(len(finished), len(failed), len(results)-len(finished)-len(failed)))
+	for e, c in failed:
+		print(" ! {0} FAILED. Code {1}".format(e, c))
+	return len(failed)
 
 def is_completed(path_list):
 	completed = True
 	for path in path_list:
 		conf = data_path+path+"/"+conf_file
-		with open(conf) as f:
-			data = f.read()
-		m = re.search("STATUS = (\d+)", data)
-		if m:
-			completed = completed and (2 == int(m.groups()[0]))
-		else:
+		if not isfile(conf):
+			return False
+		status = read_config(conf).get("STATUS")
+		if status is None:
 			print("ERROR: Did not find max. status entry in {0}".format(conf))
 			return False
+		completed = completed and (2 == status)
 	return completed
 
-def start_tournament(robot, experiment, port, num, dry):
-	setting = "{0}{1}/{4}{2}{3}".format(settings_folder, robot, experiment, settings_file_ending, tournament_prefix)
+def get_tournament_job(tournament, digests):
+	""" every set of input populations is a job of its own """
+	return "{0}.{1}".format(tournament, hashlib.md5("".join(digests)).hexdigest()[:8])
+
+def get_tournament_setting(robot, experiment):
+	return "{0}{1}/{4}{2}{3}".format(settings_folder, robot, experiment, settings_file_ending, tournament_prefix)
+
+def start_tournament(robot, experiment, num, dry):
+	setting = get_tournament_setting(robot, experiment)
 	tournament = "{0}/T_{0}_{1}".format(robot, experiment)
 	command = "nice -n {4} {0} -n {1} -s {2} -p {3} -b"\
-		.format(binary, tournament, setting, port, nice)
+		.format(binary, tournament, setting, "{0}", nice)
 
 	expfolderlist = ["{0}/{2}_{0}_{1}".format(robot, experiment, n) for n in range(num)]
 
 
 	if not isfile(setting):
-		print(" ! {0} NOT AVAILABLE -> SKIPPED.".format(setting))
-		return
+		report(" ! {0} NOT AVAILABLE -> SKIPPED.".format(setting))
+		return tournament, None
 
-	if isdir(data_path+tournament):
-		if not is_completed(expfolderlist):
-			print(" + {0} NOT READY. SKIPPED.".format(tournament))
-			return
-		elif is_up_to_date(tournament, expfolderlist):
-			print(" + {0} DONE. SKIPPED.".format(tournament))
-			return
+	if dry:
+		if isdir(data_path+tournament) and is_completed(expfolderlist) and is_up_to_date(robot, experiment, expfolderlist):
+			report(" + {0} DONE. SKIPPED.".format(tournament))
 		else:
-			print(" + {0} OUTDATED -> REFRESHING.".format(tournament))
-			if not dry:
-				clean_folder(data_path+tournament)
-	else:
-		print(" > {0}".format(tournament)),
+			report(" > {0} {1}".format(tournament, command.format("<port>")))
+		return tournament, None
+
+	if not is_completed(expfolderlist):
+		report(" + {0} NOT READY. SKIPPED.".format(tournament))
+		return tournament, None
+
+	if isdir(data_path+tournament) and is_up_to_date(robot, experiment, expfolderlist):
+		report(" + {0} DONE. SKIPPED.".format(tournament))
+		return tournament, None
+
+	digests = get_source_digests(expfolderlist)
+	job = get_tournament_job(tournament, digests)
+	if has_stale_marker(tournament, job):
+		jobs.forget(job) # not up to date, so the result is gone
+	if not jobs.claim(job, retry_failed):
+		report(" + {0} {1}. SKIPPED.".format(tournament, jobs.get_state(job).upper()))
+		return tournament, None
 
-	if not exists(data_path+robot+"/tournament"):
-		makedirs(data_path+robot+"/tournament")
+	try:
+		if isdir(data_path+tournament):
+			report(" + {0} OUTDATED -> REFRESHING.".format(tournament))
+			clean_folder(data_path+tournament)
+
+		if not exists(data_path+robot+"/tournament"):
+			makedirs(data_path+robot+"/tournament")
 
-	if not dry:
 		popsize = get_popsize(setting)
 		poplist = create_population_from(expfolderlist, popsize)
-		with open(data_path+robot+"/tournament/{0}.log".format(experiment), "w") as f:
+		source = get_tournament_source(robot, experiment)
+		with open(source+".log", "w") as f:
 			for line in poplist:
 				f.write(line)
+		if isfile(source+".md5"):
+			unlink(source+".md5")
 
 		output_path = "{0}{1}/".format(data_path, tournament)
-		exitcode, out, err = execute_command(command)
-		with open(output_path + "stdout.txt", "w") as out_file:
-			out_file.write(ansi_escape.sub('', out))
-		with open(output_path + "stderr.txt", "w") as err_file:
-			err_file.write(ansi_escape.sub('', err))
-		print "OK." if exitcode==0 else "FAILED: Code {0}".format(exitcode)
-	else:
-		print(command)
+		with leased_port(port_start) as port, jobs.Heartbeat(job):
+			report(" > {0} (port {1})".format(tournament, port))
+			exitcode = execute_logged(command.format(port), output_path)
+	except:
+		jobs.release(job)
+		raise
 
+	if exitcode == 0:
+		# digests mark the tournament as done, so only a successful run writes them
+		write_atomic(source+".md5", "\n".join(digests)+"\n")
+	jobs.finish(job, exitcode)
+	report(" < {0} {1}".format(tournament, "OK." if exitcode==0 else "FAILED: Code {0}".format(exitcode)))
+	return tournament, exitcode
 
-def start_all_tournaments(robot, experiments, port, num, dry_run):
-	print("\nTournaments:")
-	for e in experiments:
-		port += 1
-		start_tournament(robot, e, port, num, dry_run)
-	return port
 
 def main():
-	global port_start, num_conductions
+	global port_start, num_conductions, retry_failed
 
 	parser = argparse.ArgumentParser()
 	parser.add_argument('-r', '--robot' , default='_scrtst')
 	parser.add_argument('-n', '--number', default=num_conductions)
 	parser.add_argument('-p', '--port'  , default=port_start)
 	parser.add_argument('-x', '--nopass', action='store_true')
+	parser.add_argument('-j', '--jobs'  , default=cpu_count(), type=int)
+	parser.add_argument('-f', '--retry_failed', action='store_true')
+	parser.add_argument('-q', '--enqueue', action='store_true')
+	parser.add_argument('-w', '--worker' , action='store_true')
 	args = parser.parse_args()
 
 	robot           = str(args.robot)
 	num_conductions = int(args.number)
 	port_start      = int(args.port)
+	retry_failed    = args.retry_failed
 
 	check_binary()
-	experiments_available = get_available_experiments(robot)
+	if args.worker:
+		print("Worker mode, pulling jobs from the queue.")
+	else:
+		experiments_available = get_available_experiments(robot)
 
-	print("The following experiments will be conducted:")
-	for i in experiments_available: print("\t{0}/{1}".format(robot,i))
+		print("The following experiments will be {0}:".format("queued" if args.enqueue else "conducted"))
+		for i in experiments_available: print("\t{0}/{1}".format(robot,i))
 
-	if (num_conductions > 1):
-		print("Every experiment will be repeated {0} times.".format(num_conductions))
-	else:
-		print("Every experiment will be executed once.")
+		if (num_conductions > 1):
+			print("Every experiment will be repeated {0} times.".format(num_conductions))
+		else:
+			print("Every experiment will be executed once.")
 
 	dry_run = False
 	if not args.nopass:
 		var = raw_input("Enter '{0}' to proceed: ".format(passphr))
 		dry_run = (var != passphr)
 
-	port = port_start
-	for num in range(num_conductions):
-		port = conduct_all(robot, experiments_available, port, num, dry_run)
-
-
-	start_all_tournaments(robot, experiments_available, port, num_conductions, dry_run)
+	if args.enqueue:
+		enqueue_all(robot, experiments_available, num_conductions, dry_run)
+	elif args.worker:
+		print("Using {0} parallel worker(s).".format(args.jobs))
+		print_summary(work(max(1, args.jobs), dry_run))
+	else:
+		print("Using {0} parallel worker(s).".format(args.jobs))
+		executor = Executor(max(1, args.jobs))
+		schedule_all(executor, robot, experiments_available, num_conductions, dry_run)
+		executor.wait()
+		print_summary(executor.results)
 
 	print("\n____\nDONE.\n")
 
@@ -0,0 +1,145 @@
+""" persistent experiment index
+    ---------------------------
+    remembers directory listings and a summary of every experiment
+    (robot id, status, trials, fitness) in a json file, so scanning
+    ../data/exp over nfs only has to stat files. listings and
+    entries are refreshed only when the modification time or size
+    of the underlying directory or file has changed. logs are
+    append-only, so line counts and fitness statistics are updated
+    from the byte offset where the last scan stopped.
+"""
+import json, time, atexit
+from os import listdir
+from os.path import isdir, join, abspath, dirname
+from config import read_config
+from logs import count_lines, get_stamp, write_atomic
+
+index_file  = "../data/exp.index.json"
+config_file = "evolution.conf"
+log_file    = "evolution.log"
+fit_log     = "fitness.log"
+data_log    = "data/data.log"
+
+
+def empty_fitness():
+    return {"count": 0, "sum": 0.0, "max": 0.0, "min": 0.0, "offset": 0}
+
+
+def update_fitness_summary(filename, summary):
+    """ adds the lines appended to fitness.log since summary["offset"],
+        an incomplete last line is left for the next update """
+    with open(filename, "rb") as f:
+        f.seek(summary["offset"])
+        data = f.read()
+    end = data.rfind(b"\n") + 1
+    for line in data[:end].splitlines():
+        if not line.strip():
+            continue
+        value = float(line.split()[0])
+        first = summary["count"] == 0
+        summary["max"] = value if first else max(summary["max"], value)
+        summary["min"] = value if first else min(summary["min"], value)
+        summary["sum"] += value
+        summary["count"] += 1
+    summary["offset"] += end
+    return summary
+
+
+class ExperimentIndex:
+    def __init__(self, filename = index_file):
+        self.filename = filename
+        self.dirty = False
+        self.dirs = {}
+        self.experiments = {}
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+            self.dirs = data.get("dirs", {})
+            self.experiments = data.get("experiments", {})
+        except (IOError, ValueError):
+            pass # no index yet or broken, start from scratch
+
+    def save(self):
+        if not self.dirty:
+            return
+        folder = dirname(abspath(self.filename))
+        if not isdir(folder):
+            return
+        write_atomic(self.filename, json.dumps({"dirs": self.dirs, "experiments": self.experiments}))
+        self.dirty = False
+
+    def subdirs(self, path):
+        """ sorted names of sub directories, cached by the mtime of path """
+        key = abspath(path)
+        stamp = get_stamp(path)
+        if stamp is None:
+            raise OSError("No such directory: {0}".format(path))
+        entry = self.dirs.get(key)
+        # listings taken in the same second as the last change may be incomplete
+        if entry and entry["mtime"] == stamp[0] and entry["listed"] > stamp[0] + 1:
+            return entry["subdirs"]
+        listed = time.time()
+        dirs = sorted(d for d in listdir(path) if isdir(join(path, d)))
+        self.dirs[key] = {"mtime": stamp[0], "listed": listed, "subdirs": dirs}
+        self.dirty = True
+        return dirs
+
+    def get(self, path):
+        """ summary of the experiment in path or None, if it is none """
+        path = path.rstrip("/")
+        key = abspath(path)
+        stamps = { name: get_stamp(join(path, name))
+                   for name in [config_file, log_file, fit_log, data_log] }
+        if stamps[config_file] is None:
+            if key in self.experiments:
+                del self.experiments[key]
+                self.dirty = True
+            return None
+
+        entry = self.experiments.get(key)
+        if entry is None:
+            # missing logs never count as changed, so new entries start empty
+            entry = {"files": {}, "trials": 0, "log_offset": 0, "fitness": empty_fitness()}
+        changed = lambda name: entry["files"].get(name) != stamps[name]
+
+        if changed(config_file):
+            conf = read_config(join(path, config_file))
+            entry["robot"]      = int(conf.get("ROBOT", 0))
+            entry["status"]     = int(conf.get("STATUS", -1))
+            entry["max_trials"] = int(conf.get("MAX_TRIALS", 0))
+            entry["symmetric"]  = conf.get("SYMMETRIC_CONTROLLER") is True
+        if changed(log_file):
+            # logs only grow, so just count the lines appended since the last scan
+            offset = entry.get("log_offset", 0)
+            if stamps[log_file] is None or stamps[log_file][1] < offset or "log_offset" not in entry:
+                entry["trials"], offset = 0, 0
+            if stamps[log_file] is not None:
+                lines, offset = count_lines(join(path, log_file), offset)
+                entry["trials"] += lines
+            entry["log_offset"] = offset
+        if changed(fit_log):
+            fitness = entry.get("fitness", {})
+            if stamps[fit_log] is None or stamps[fit_log][1] < fitness.get("offset", 0) or "offset" not in fitness:
+                fitness = empty_fitness()
+            if stamps[fit_log] is not None:
+                update_fitness_summary(join(path, fit_log), fitness)
+            entry["fitness"] = fitness
+
+        entry["has_log"]  = stamps[log_file] is not None
+        entry["recorded"] = stamps[data_log] is not None
+        if entry["files"] != stamps:
+            entry["files"] = stamps
+            self.experiments[key] = entry
+            self.dirty = True
+        return entry
+
+
+the_index = None
+
+def open_index():
+    """ one shared index per process, written back at exit """
+    global the_index
+    if the_index is None:
+        the_index = ExperimentIndex()
+        atexit.register(the_index.save)
+    return the_index
@@ -3,6 +3,7 @@
 import sys, socket, subprocess, time, random, re, shlex
 from os import listdir, makedirs
 from os.path import isfile, isdir, join, exists
+from config import get_value
 
 # globals
 sim_path = "./bin/Release/simloid"
@@ -70,27 +71,12 @@ def is_experiment(path):
 
 def is_completed(path):
     conf = path+"/"+constants.config_file
-    with open(conf) as f:
-        data = f.read()
-    m = re.search("STATUS = (\d+)", data)
-    if m:
-        return 2 == int(m.groups()[0])
-    print("ERROR: Did not find status entry in {0}".format(conf))
-    return False
+    return 2 == get_value(conf, "STATUS")
 
 
 def get_robot_rand_init(path):
     conf = path.rstrip('/') + "/" +constants.config_file
-    with open(conf) as f:
-        data = f.read()
-    m = re.search("RANDOM_INIT = (\d+)", data)
-    if m:
-        id = int(m.groups()[0])
-        #print("Robot ID is: {}".format(id))
-        return id
-    else:
-        print("ERROR: Did not find random init entry in {0}".format(conf))
-        return 0
+    return get_value(conf, "RANDOM_INIT", 0)
 
 
 def get_int_from_str(msg, item):
@@ -0,0 +1,173 @@
+""" job states shared by concurrent launchers
+    -----------------------------------------
+    every job (an experiment run or a tournament) is claimed by
+    atomically creating a claim file on the shared file system.
+    the owner keeps the claim alive by a heartbeat, i.e. touching
+    the file. claims without heartbeat are considered dead and can
+    be taken over by other launchers. finished jobs are marked
+    with a .done or .failed file.
+
+    states: open -> claimed -> done | failed
+
+    jobs can also be put into a queue, a directory with one json
+    file per job, from which workers on any host pull them.
+"""
+import os, errno, socket, time, threading, json
+from os import listdir
+from os.path import isfile, isdir, getmtime, join
+from common import create_folder, write_atomic
+
+jobs_path   = "../data/jobs/"
+queue_path  = jobs_path + "queue/"
+heartbeat   = 60.0  # seconds between touching the claim file
+stale_after = 600.0 # seconds without heartbeat until a claim is dead
+
+
+def state_file(job, state):
+    return "{0}{1}.{2}".format(jobs_path, job, state)
+
+
+def owner():
+    return "{0} {1} {2}".format(socket.gethostname(), os.getpid(), threading.current_thread().name)
+
+
+def create_exclusive(filename, content):
+    try:
+        fd = os.open(filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o664)
+    except OSError as e:
+        if e.errno == errno.EEXIST:
+            return False
+        raise
+    os.write(fd, content.encode())
+    os.close(fd)
+    return True
+
+
+def remove(filename):
+    try:
+        os.unlink(filename)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def is_stale(filename):
+    try:
+        return time.time() - getmtime(filename) > stale_after
+    except OSError:
+        return False # removed in the meantime
+
+
+def get_state(job):
+    """ returns one of: open, claimed, dead, done, failed """
+    for state in ["done", "failed", "claim"]:
+        if isfile(state_file(job, state)):
+            if state != "claim":
+                return state
+            return "dead" if is_stale(state_file(job, state)) else "claimed"
+    return "open"
+
+
+def take_over(job):
+    """ replaces a dead claim, only one launcher at a time may try """
+    lock = state_file(job, "takeover")
+    if not create_exclusive(lock, owner()):
+        if is_stale(lock):
+            remove(lock)
+        return False
+    try:
+        claim = state_file(job, "claim")
+        if not is_stale(claim):
+            return False
+        remove(claim)
+        return create_exclusive(claim, owner())
+    finally:
+        remove(lock)
+
+
+def claim(job, retry_failed = False):
+    """ returns True, if the job was claimed by this launcher """
+    create_folder(os.path.dirname(state_file(job, "claim")))
+
+    if isfile(state_file(job, "done")):
+        return False
+    if isfile(state_file(job, "failed")):
+        if not retry_failed:
+            return False
+        remove(state_file(job, "failed"))
+
+    if create_exclusive(state_file(job, "claim"), owner()):
+        return True
+    return take_over(job)
+
+
+def finish(job, exitcode):
+    state = "done" if exitcode == 0 else "failed"
+    with open(state_file(job, state), "w") as f:
+        f.write("{0} {1}\n".format(owner(), exitcode))
+    remove(state_file(job, "claim"))
+
+
+def forget(job):
+    """ removes the result markers, e.g. when the data was deleted """
+    remove(state_file(job, "done"))
+    remove(state_file(job, "failed"))
+
+
+def release(job):
+    """ gives a claimed job back without result """
+    remove(state_file(job, "claim"))
+
+
+def enqueue(job, params):
+    filename = queue_path + job + ".json"
+    create_folder(os.path.dirname(filename))
+    write_atomic(filename, json.dumps(params)) # workers never see half written jobs
+
+
+def dequeue(job):
+    remove(queue_path + job + ".json")
+
+
+def get_queued():
+    """ list of (job, params) of all queued jobs """
+    queued = []
+    if not isdir(queue_path):
+        return queued
+    for folder in listdir(queue_path):
+        if not isdir(join(queue_path, folder)):
+            continue
+        for f in listdir(join(queue_path, folder)):
+            if not f.endswith(".json"):
+                continue
+            try:
+                with open(join(queue_path, folder, f)) as fp:
+                    params = json.load(fp)
+            except (IOError, ValueError):
+                continue # dequeued in the meantime
+            queued.append((folder + "/" + f[:-len(".json")], params))
+    return queued
+
+
+class Heartbeat:
+    """ keeps the claim of a job alive while it is running """
+    def __init__(self, job):
+        self.claim = state_file(job, "claim")
+        self.stop  = threading.Event()
+        self.thread = threading.Thread(target=self.beat)
+        self.thread.daemon = True
+
+    def beat(self):
+        while not self.stop.wait(heartbeat):
+            try:
+                os.utime(self.claim, None)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop.set()
+        self.thread.join()
@@ -0,0 +1,187 @@
+""" fast access to large, growing log files
+    -------------------------------------
+    lines are counted by reading large blocks and counting newlines,
+    the last line is found by reading blocks backwards from the end.
+    a LogFollower remembers offset and count, so repeated updates
+    only read the bytes appended in the meantime.
+    read_log parses large numeric logs in parallel: the file is split
+    into newline-aligned byte ranges, which are parsed by a process
+    pool and copied into one preallocated array.
+    caches and indices derived from logs are written with write_atomic
+    and checked against the get_stamp of their log.
+"""
+import os
+from os.path import isfile, getsize
+from multiprocessing import Pool, cpu_count
+import numpy as np
+
+block_size = 1 << 20
+chunk_size = 1 << 26 # bytes parsed per task of read_log
+
+
+def get_stamp(filename):
+    """ (mtime, size) of a file or None, if it does not exist """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return [st.st_mtime, st.st_size]
+
+
+def write_atomic(filename, data):
+    """ writes to a private temporary file which is renamed, so readers
+        never see half written files and the last writer wins """
+    tmp = "{0}.{1}.tmp".format(filename, os.getpid())
+    with open(tmp, "w") as f:
+        f.write(data)
+    os.rename(tmp, filename)
+
+
+def count_lines(filename, offset = 0):
+    """ returns the number of lines after offset and the new offset """
+    count = 0
+    with open(filename, "rb") as f:
+        f.seek(offset)
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            count += block.count(b"\n")
+            offset += len(block)
+    return count, offset
+
+
+def tail(filename, block = 4096):
+    """ last non-empty line of a file without newline """
+    with open(filename, "rb") as f:
+        f.seek(0, 2)
+        pos = f.tell()
+        data = b""
+        while pos > 0:
+            step = min(block, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+            lines = data.rstrip(b"\n").split(b"\n")
+            if len(lines) > 1:
+                return lines[-1]
+        return data.rstrip(b"\n")
+
+
+class LogFollower:
+    """ counts lines and keeps the last one of a growing log file,
+        reading only the bytes appended since the last update.
+        the lines with the numbers in marks (counted from 1) are
+        kept in marked, whenever the update happens. """
+    def __init__(self, filename, offset = 0, lines = 0, marks = ()):
+        self.filename = filename
+        self.offset = offset
+        self.lines = lines
+        self.last = ""
+        self.rest = ""
+        self.marks = sorted(marks)
+        self.marked = {}
+
+    def update(self):
+        if not isfile(self.filename):
+            return self.lines
+        with open(self.filename, "rb") as f:
+            f.seek(self.offset)
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                self.offset += len(block)
+                data = self.rest + block
+                end = data.rfind(b"\n")
+                if end < 0:
+                    self.rest = data # incomplete last line
+                    continue
+                count = data.count(b"\n")
+                hits = [m for m in self.marks if self.lines < m <= self.lines + count]
+                if hits:
+                    lines = data[:end].split(b"\n")
+                    for m in hits:
+                        self.marked[m] = lines[m - self.lines - 1]
+                self.lines += count
+                self.last = data[data.rfind(b"\n", 0, end)+1:end]
+                self.rest = data[end+1:]
+        return self.lines
+
+
+def split_ranges(filename, size):
+    """ byte ranges of about size bytes, each ending after a newline """
+    ranges = []
+    total = getsize(filename)
+    with open(filename, "rb") as f:
+        start = 0
+        while start < total:
+            f.seek(min(start + size, total))
+            f.readline() # move on to the end of the line
+            end = min(f.tell(), total)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def count_range(args):
+    """ upper bound of the rows in the byte range, blank lines included """
+    filename, start, end = args
+    with open(filename, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return data.count(b"\n") + (0 if data.endswith(b"\n") else 1)
+
+
+def parse_range(args):
+    """ rows of whitespace separated numbers in the byte range """
+    filename, start, end, ncols, dtype = args
+    with open(filename, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    values = np.fromstring(data, dtype=dtype, sep=" ")
+    if values.size % ncols != 0:
+        raise ValueError("{0}: bytes {1}-{2} do not hold rows of {3} numbers.".format(filename, start, end, ncols))
+    return values.reshape(-1, ncols)
+
+
+def read_chunks(filename, dtype = np.float64, processes = None):
+    """ upper bound of the rows of a numeric log and an iterator over
+        its parsed chunks in file order, so large logs are processed
+        without holding all rows. chunks are parsed in parallel. """
+    with open(filename, "rb") as f:
+        ncols = len(f.readline().split())
+    tasks = [(filename, start, end) for start, end in split_ranges(filename, chunk_size)]
+    if len(tasks) <= 1:
+        return sum(map(count_range, tasks)), (parse_range(t + (ncols, dtype)) for t in tasks)
+
+    pool = Pool(min(processes or cpu_count(), len(tasks)))
+    try:
+        counts = pool.map_async(count_range, tasks).get(0xFFFFFFFF)
+    except:
+        pool.terminate()
+        raise
+
+    def chunks():
+        try:
+            for values in pool.imap(parse_range, [t + (ncols, dtype) for t in tasks]):
+                yield values
+        finally:
+            pool.close()
+            pool.join()
+    return sum(counts), chunks()
+
+
+def read_log(filename, usecols = None, dtype = np.float64, processes = None):
+    """ numeric log as 2d array, large files are parsed in parallel """
+    with open(filename, "rb") as f:
+        ncols = len(f.readline().split())
+    cols = list(usecols) if usecols is not None else range(ncols)
+    # rows are counted first, so each parsed chunk is copied only once into place
+    rows, chunks = read_chunks(filename, dtype, processes)
+    result = np.empty((rows, len(cols)), dtype)
+    row = 0
+    for values in chunks:
+        result[row:row+len(values)] = values[:, cols]
+        row += len(values)
+    return result[:row]
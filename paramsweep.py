@@ -1,11 +1,16 @@
 #!/usr/bin/python
 
-import re, sys, shlex, argparse, fcntl, time
-from subprocess import Popen, PIPE
+import re, argparse, json, tempfile, os, signal, threading, hashlib
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 from os import listdir, makedirs, unlink
-from os.path import isfile, isdir, join, getmtime, exists
+from os.path import isfile, isdir, join, exists
 from math import ceil
 import numpy as np
+from ports import leased_port
+from common import execute_logged, count_lines, tail, LogFollower, report, create_folder, write_atomic
+from config import get_value
+from designs import Param, create_design
 
 port_start      = 8000
 def_number      = 20
@@ -13,29 +18,70 @@ def_number      = 20
 nice = 19
 binary = "./bin/Release/evolution-1.0.1"
 data_path = "../data/exp/"
+sweep_path = "../data/sweep/"
 settings_folder = "./settings/"
 settings_file_ending = ".setting"
-
-ansi_escape = re.compile(r'\x1b[^m]*m')
-
-
-def write_locked(fname, op, line):
-	fout = open(fname, op)
-	while True:
-		try:
-			fcntl.flock(fout, fcntl.LOCK_EX | fcntl.LOCK_NB)
-			break
-		except IOError as e:
-			# raise on unrelated IOErrors
-			if e.errno != errno.EAGAIN:
-				raise
-			else:
-				time.sleep(0.25)
-
-	fout.write(line)
-	fout.flush()
-	fcntl.flock(fout, fcntl.LOCK_UN)
-	fout.close()
+halving = None
+
+
+def get_sweep_name(design, grid):
+	""" design and digest of all points, so only the same sweep finds
+	    its earlier runs and results """
+	return "{0}_{1}".format(design, hashlib.md5(json.dumps(grid)).hexdigest()[:8])
+
+
+def get_run_name(robot, experiment, sweep, idx):
+	return "{0}/{3}_{0}_{1}_{2}".format(robot, experiment, sweep, idx)
+
+
+def get_results_folder(robot, experiment, sweep):
+	return "{0}{1}/{2}/{3}/".format(sweep_path, robot, experiment, sweep)
+
+
+def save_result(folder, idx, params, fitness, stopped = False):
+	""" one json file per run, written atomically, so parallel
+	    runs never wait for each other or see half written results """
+	create_folder(folder)
+	result = {"idx": idx, "params": [[k, v] for k, v in params], "fitness": fitness, "stopped": stopped}
+	write_atomic("{0}{1}.json".format(folder, idx), json.dumps(result))
+
+
+def load_results(folder):
+	""" all results of a sweep as numpy record array, one row per run with
+	    columns idx, the swept parameters, trials, fmax, favg, fmin and
+	    stopped (1 if stopped early by successive halving) """
+	results = []
+	for f in listdir(folder) if isdir(folder) else []:
+		if f.endswith(".json"):
+			with open(join(folder, f)) as fp:
+				results.append(json.load(fp))
+	if not results:
+		return None
+	results.sort(key=lambda r: r["idx"])
+	keys = [k for k, v in results[0]["params"]]
+	mixed = [r["idx"] for r in results if [k for k, v in r["params"]] != keys]
+	if mixed:
+		raise ValueError("Results {0} in {1} sweep other parameters than {2}.".format(mixed, folder, ", ".join(keys)))
+	fields = ["trials", "fmax", "favg", "fmin"]
+	types = [("idx", int)] \
+	      + [(str(k), type(v)) for k, v in results[0]["params"]] \
+	      + [(f, int if f == "trials" else float) for f in fields] \
+	      + [("stopped", int)]
+	rows = [tuple([r["idx"]] + [v for k, v in r["params"]] + [r["fitness"][f] for f in fields] + [int(r.get("stopped", False))])
+	        for r in results]
+	return np.array(rows, dtype=types)
+
+
+def merge_results(folder):
+	""" writes the results of a sweep as one table, readable with
+	    np.genfromtxt(filename, names=True) """
+	results = load_results(folder)
+	if results is None:
+		return None
+	filename = folder.rstrip("/") + ".results"
+	fmt = ["%d" if results.dtype[n].kind == "i" else "%.10g" for n in results.dtype.names]
+	np.savetxt(filename, results, fmt=fmt, header=" ".join(results.dtype.names))
+	return filename
 
 
 def check_binary():
@@ -45,84 +91,211 @@ def check_binary():
 		print("Could not find evolution binary {0}".format(binary))
 
 
-def execute_command(command):
-	args = shlex.split(command)
-	proc = Popen(args, stdout=PIPE, stderr=PIPE)
-	out, err = proc.communicate()
-	exitcode = proc.returncode
-	return exitcode, out, err
+def apply_settings(filename, setlist):
+	""" text of the setting with the (key, value) pairs of setlist
+	    replaced or appended """
+	with open(filename, "r") as f:
+		data = f.read()
+	for key, value in setlist:
+		line = "{0} = {1}".format(key, value)
+		data, found = re.subn(r"(?m)^{0} = .*$".format(re.escape(key)), line, data)
+		if not found:
+			data = data.rstrip("\n") + "\n" + line + "\n"
+	if re.search(r"(?m)= \{\d+\}$", data):
+		raise ValueError("Placeholder in {0} is not covered by the sweep parameters.".format(filename))
+	return data
 
 
 def override_settings(filename, setlist = ()):
+	""" returns a private copy of the setting with the (key, value)
+	    pairs of setlist replaced or appended """
 	if setlist:
-		with open(filename, "r") as f:
-			data = f.read().format(*setlist)
-			newfile = filename+".tmp"
-			write_locked(newfile, "w+", data)
-			return newfile
+		data = apply_settings(filename, setlist)
+		fd, newfile = tempfile.mkstemp(prefix="paramsweep_", suffix=settings_file_ending)
+		with os.fdopen(fd, "w") as f:
+			f.write(data)
+		return newfile
 	else:
 		return filename
 
 
-def conduct(robot, experiment, port, num, dry, add_settings = ()):
-	expname = "{0}/{2}_{0}_{1}".format(robot, experiment, num)
+def get_fitness(line):
+	""" average fitness of a line of evolution.log (fmax favg fmin) """
+	values = line.split()
+	return float(values[1] if len(values) > 1 else values[0]) if values else 0.0
+
+
+class Halving:
+	""" successive halving: when a run reaches a rung (number of trials),
+	    it is stopped unless its fitness is within the best 1/eta of all
+	    runs which reached this rung so far. the freed workers go on
+	    with the remaining grid points. """
+	def __init__(self, max_trials, eta, num_rungs):
+		self.eta = eta
+		self.rungs = sorted(set(int(max_trials / eta**k) for k in range(1, num_rungs+1)))
+		self.seen = [[] for r in self.rungs]
+		self.running = {}
+		self.stopped = {} # expname -> fitness at the rung it was stopped
+		self.lock = threading.Lock()
+		print("Checkpoints at trials: {0}".format(self.rungs))
+
+	def register(self, expname, proc):
+		with self.lock:
+			self.running[expname] = [proc, LogFollower(data_path+expname+"/evolution.log", marks=self.rungs), 0]
+
+	def unregister(self, expname):
+		with self.lock:
+			self.running.pop(expname, None)
+			return expname in self.stopped
+
+	def is_promoted(self, rung, fitness):
+		seen = self.seen[rung]
+		seen.append(fitness)
+		if len(seen) < self.eta:
+			return True # not enough runs to compare with
+		keep = int(ceil(len(seen) / float(self.eta)))
+		return fitness >= sorted(seen, reverse=True)[keep-1]
+
+	def check(self):
+		with self.lock:
+			for expname, run in self.running.items():
+				proc, log, rung = run
+				trials = log.update()
+				while rung < len(self.rungs) and trials >= self.rungs[rung]:
+					# all runs are compared at the same number of trials
+					line = log.marked[self.rungs[rung]]
+					fitness = get_fitness(line)
+					if not self.is_promoted(rung, fitness):
+						report(" - {0} STOPPED at {1} trials, fitness {2}".format(expname, self.rungs[rung], fitness))
+						self.stopped[expname] = parse_fitness(self.rungs[rung], line)
+						try:
+							os.killpg(proc.pid, signal.SIGTERM)
+						except OSError:
+							pass # finished meanwhile
+						break
+					rung += 1
+				run[2] = rung
+
+	def watch(self, done, interval = 5.0):
+		while not done.wait(interval):
+			self.check()
+
+
+def conduct(robot, experiment, sweep, num, dry, add_settings = ()):
+	expname = get_run_name(robot, experiment, sweep, num)
 	if isdir(data_path+expname):
-		print(" + {0} DONE. SKIPPED.".format(expname))
+		report(" + {0} DONE. SKIPPED.".format(expname))
 		return False
-	else:
-		print(" > {0}".format(expname)),
 
-	setting = "{0}{1}/{2}{3}".format(settings_folder, robot, experiment, settings_file_ending)
-	if not dry:
-		setting = override_settings(setting, add_settings)
+	original = "{0}{1}/{2}{3}".format(settings_folder, robot, experiment, settings_file_ending)
+	setting = original if dry else override_settings(original, add_settings)
 
 	command = "nice -n {4} {0} -n {1} -s {2} -p {3} -b"\
-		.format(binary, expname, setting, port, nice)
+		.format(binary, expname, setting, "{0}", nice)
 
 	if not exists(data_path+robot):
 		makedirs(data_path+robot)
 
 	if not dry:
 		output_path = "{0}{1}/".format(data_path, expname)
+		exitcode = -1
 		try:
-			exitcode, out, err = execute_command(command)
-			with open(output_path + "stdout.txt", "w") as out_file:
-				out_file.write(ansi_escape.sub('', out))
-			with open(output_path + "stderr.txt", "w") as err_file:
-				err_file.write(ansi_escape.sub('', err))
-		except:
-			print("ERROR")
-
+			with leased_port(port_start) as port:
+				report(" > {0} (port {1})".format(expname, port))
+				if halving is None:
+					exitcode = execute_logged(command.format(port), output_path)
+				else:
+					register = lambda proc: halving.register(expname, proc)
+					exitcode = execute_logged(command.format(port), output_path, on_start=register, new_session=True)
+		except Exception as e:
+			report(" ! {0} ERROR: {1}".format(expname, e))
+		finally:
+			if setting != original:
+				unlink(setting)
+
+		if halving is not None and halving.unregister(expname):
+			return False
 		if exitcode==0:
-			print("OK.")
+			report(" < {0} OK.".format(expname))
 			return True
 		else:
-			print("FAILED. Code {0}".format(exitcode))
+			report(" < {0} FAILED. Code {1}".format(expname, exitcode))
 			return False
 	else:
-		print(command)
+		report(" > {0} {1}".format(expname, command.format("<port>")))
 		return False
 
 
-def tail(filename):
-	with open(filename, "rb") as f:
-		first = f.readline()      # Read the first line.
-		f.seek(-2, 2)             # Jump to the second last byte.
-		while f.read(1) != b"\n": # Until EOL is found...
-			f.seek(-2, 1)         # ...jump back the read byte plus one more.
-		last = f.readline()       # Read last line.
-		return last
+def parse_fitness(trials, line):
+	""" fitness (fmax favg fmin) of a line of evolution.log """
+	values = [float(v) for v in line.split()[:3]] + [0.0]*3
+	return {"trials": trials, "fmax": values[0], "favg": values[1], "fmin": values[2]}
+
+
+def get_final_fitness(filename):
+	""" number of trials and fitness at the end of evolution.log """
+	trials, size = count_lines(filename)
+	return parse_fitness(trials, tail(filename))
+
+
+def conduct_point(robot, experiment, sweep, idx, params, dry):
+	report("Conducting with {0}".format(", ".join("{0}={1}".format(k, v) for k, v in params)))
+	res = conduct(robot, experiment, sweep, idx, dry, add_settings=params)
+	expname = get_run_name(robot, experiment, sweep, idx)
+	if res:
+		fitness = get_final_fitness(data_path+expname+"/evolution.log")
+		save_result(get_results_folder(robot, experiment, sweep), idx, params, fitness)
+	elif halving is not None and expname in halving.stopped:
+		# stopped runs keep their folder, their result tells a rerun why
+		save_result(get_results_folder(robot, experiment, sweep), idx, params, halving.stopped[expname], stopped=True)
+	return res
+
+
+def get_params(args):
+	""" the swept parameters, by default popsize and mutation rate """
+	params = args.param or [ "POPULATION_SIZE:5:100:int"
+	                       , "INIT_MUTATION_RATE:0.001:1:log" ]
+	params = [Param(p) for p in params]
+	if "META_MUTATION_RATE" not in [p.key for p in params]:
+		params.append(Param("META_MUTATION_RATE:{0}".format(args.meta)))
+	return params
+
+
+def conduct_all(robot, experiment, sweep, grid, workers, dry):
+	run = lambda point: conduct_point(robot, experiment, sweep, point[0], point[1], dry)
+	pool = ThreadPool(max(1, min(workers, len(grid))))
+	done = threading.Event()
+	if halving is not None:
+		watcher = threading.Thread(target=halving.watch, args=(done,))
+		watcher.daemon = True
+		watcher.start()
+	try:
+		# async get with timeout keeps the pool interruptible by Ctrl-C
+		results = pool.map_async(run, list(enumerate(grid)), chunksize=1).get(0xFFFFFFFF)
+	finally:
+		done.set()
+		pool.close()
+	pool.join()
+	return results
 
 
 def main():
-	global port_start
+	global port_start, halving
 
 	parser = argparse.ArgumentParser()
 	parser.add_argument('-r', '--robot' , required=True)
 	parser.add_argument('-p', '--port'  , default=port_start)
 	parser.add_argument('-d', '--dry'   , action='store_true')
-	parser.add_argument('-n', '--number', default=def_number)
-	parser.add_argument('-m', '--meta'  , default=0.5)
+	parser.add_argument('-n', '--number', default=def_number, type=int)
+	parser.add_argument('-m', '--meta'  , default=0.5, type=float)
+	parser.add_argument('-j', '--jobs'  , default=cpu_count(), type=int)
+	parser.add_argument('-a', '--adaptive', action='store_true')
+	parser.add_argument('-e', '--eta'   , default=3, type=int)
+	parser.add_argument('-k', '--rungs' , default=3, type=int)
+	parser.add_argument('-P', '--param' , action='append', help="KEY:lo:hi[:log][:int] or KEY:value, repeatable")
+	parser.add_argument('-s', '--design', default="grid", choices=["grid", "lhs", "sobol"])
+	parser.add_argument('-b', '--budget', default=None, type=int, help="number of runs for lhs and sobol")
+	parser.add_argument(      '--seed'  , default=None, type=int)
 	args = parser.parse_args()
 
 	robot           = str(args.robot)
@@ -131,22 +304,33 @@ def main():
 	check_binary()
 
 	experiment = "31_p_0fw_e_param_sweep"
-	idx = 0
-	me = args.meta
-
-	for ps in np.linspace(5, 100, num=args.number):
-		for mr in [round(x,10) for x in np.logspace(-3, 0, num=args.number)]:
-			print("Conducting with mutation rate {0} and popsize {1} and meta {2}".format(mr,int(ps),me))
-			res = conduct(robot, experiment, port_start, idx, args.dry, add_settings=(int(ps),mr,me))
-			port_start += 1 if port_start != 8089 else 2
-			# get fitness
-			if args.dry:
-				continue
-			if res:
-				line = "{0} {1} {2}".format(int(ps),mr,tail(data_path+robot+"/"+str(idx)+"_"+robot+"_"+experiment+"/evolution.log"))
-				write_locked("results.log", "a+", line)
-
-			idx += 1
+	params = get_params(args)
+	budget = args.budget or args.number**2
+	grid = create_design(params, args.design, budget, args.number, args.seed)
+	sweep = get_sweep_name(args.design, grid)
+	print("Sweeping {0} with {1} design, sweep {2}.".format(", ".join(p.key for p in params if not p.is_fixed()), args.design, sweep))
+	setting = "{0}{1}/{2}{3}".format(settings_folder, robot, experiment, settings_file_ending)
+	try:
+		apply_settings(setting, grid[0]) # all points set the same keys
+	except (IOError, ValueError) as e:
+		print("Error: {0}".format(e))
+		return
+	if args.adaptive:
+		halving = Halving(get_value(setting, "MAX_TRIALS", 0), args.eta, args.rungs)
+	print("Conducting {0} points with {1} parallel worker(s).".format(len(grid), args.jobs))
+
+	results = conduct_all(robot, experiment, sweep, grid, args.jobs, args.dry)
+	print("{0} of {1} runs finished successfully.".format(sum(results), len(grid)))
+	if halving is not None:
+		print("{0} runs stopped early.".format(len(halving.stopped)))
+	if not args.dry:
+		try:
+			table = merge_results(get_results_folder(robot, experiment, sweep))
+		except ValueError as e:
+			print("Error: {0}".format(e))
+			table = None
+		if table is not None:
+			print("Results written to {0}".format(table))
 
 	print("\n____\nDONE.\n")
 
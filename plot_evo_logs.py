@@ -39,7 +39,7 @@ def prepare_figure():
 
 
 def read_csv(filename):
-    return pd.read_csv(filename, sep=' ', header=None, names=columns)
+    return pd.DataFrame(read_log(filename, usecols=range(len(columns))), columns=columns)
 
 
 def create_evolog(target, experiment):
@@ -0,0 +1,113 @@
+""" port allocation for simloid instances
+    -------------------------------------
+    hands out free TCP ports to all launchers on one host.
+    a port is leased by a file in lease_dir which holds the pid
+    of its owner. all lease operations are serialized by an flock,
+    leases of dead processes are taken over, so crashed launchers
+    do not block ports forever.
+"""
+import os, errno, socket, fcntl
+from contextlib import contextmanager
+
+port_start = 8000
+port_end   = 9000
+lease_dir  = "/tmp/simloid-ports"
+
+
+def lease_file(port):
+    return "{0}/{1}.lease".format(lease_dir, port)
+
+
+def open_shared(filename, flags):
+    """ file descriptor of a file every user may write, the umask
+        would otherwise lock out the launchers of other users """
+    fd = os.open(filename, flags | os.O_CREAT, 0o666)
+    try:
+        os.fchmod(fd, 0o666)
+    except OSError as e:
+        if e.errno != errno.EPERM:
+            raise # not the owner, created by another user
+    return fd
+
+
+@contextmanager
+def locked():
+    if not os.path.isdir(lease_dir):
+        try:
+            os.makedirs(lease_dir)
+            os.chmod(lease_dir, 0o1777) # shared between users like /tmp
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+    fd = open_shared(lease_dir+"/.lock", os.O_WRONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX) # blocks, no busy waiting
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def is_leased(port):
+    try:
+        with open(lease_file(port)) as f:
+            pid = int(f.read().strip())
+    except (IOError, ValueError):
+        return False
+    return is_alive(pid)
+
+
+def is_free(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind(("", port))
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+
+def acquire_port(start = port_start, end = port_end):
+    """ leases and returns the first free port in [start, end) """
+    with locked():
+        for port in range(start, end):
+            if is_leased(port) or not is_free(port):
+                continue
+            fd = open_shared(lease_file(port), os.O_WRONLY | os.O_TRUNC)
+            os.write(fd, str(os.getpid()).encode())
+            os.close(fd)
+            return port
+    raise RuntimeError("No free port in range {0}-{1}.".format(start, end))
+
+
+def release_port(port):
+    with locked():
+        try:
+            os.unlink(lease_file(port))
+        except OSError as e:
+            if e.errno == errno.EPERM:
+                # taken over from another user, the sticky lease dir
+                # forbids removing it, so an empty lease marks it free
+                os.close(open_shared(lease_file(port), os.O_WRONLY | os.O_TRUNC))
+            elif e.errno != errno.ENOENT:
+                raise
+
+
+@contextmanager
+def leased_port(start = port_start, end = port_end):
+    port = acquire_port(start, end)
+    try:
+        yield port
+    finally:
+        release_port(port)
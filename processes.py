@@ -6,6 +6,7 @@
 # sudo pip install cryptography --force-reinstall
 
 import re, sys, shlex, argparse, getpass, paramiko, time
+from multiprocessing.pool import ThreadPool
 from subprocess import Popen, PIPE
 from os import listdir
 from os.path import isfile, isdir, join
@@ -21,78 +22,124 @@ server_list = [ "gruenau1"
               , "gruenau8"
               ]
 
-def get_num_processes(ssh, verbose):
-    s = search_for(ssh, "simloid"  , verbose)
-    e = search_for(ssh, "evolution", verbose)
-    if e != 2*s:
-        print("WARNING: broken process chain.")
-    return s
+# everything needed for the status of a host in one round-trip
+status_cmd = "nproc; cat /proc/loadavg; ps -e -o comm="
 
-def search_for(ssh, processname, verbose):
-    cmd = "ps -e | grep '{}'".format(processname)
-    stdin, stdout, stderr = ssh.exec_command(cmd)
-    lines = stdout.readlines() + stderr.readlines()
 
-    if verbose:
-        print("\n({1}) {0}".format(processname, len(lines)))
-        if lines > 0:
-            for line in lines:
-                print(line),
-    return len(lines)
+class Host:
+    """ server with a connection that is kept open between polls """
+    def __init__(self, name, user, pswd):
+        self.name = name
+        self.user = user
+        self.pswd = pswd
+        self.ssh  = None
 
-def kill(ssh, processname):
-    cmd = "pkill -f -9 {}".format(processname)
-    stdin, stdout, stderr = ssh.exec_command(cmd)
-    lines = stdout.readlines() + stderr.readlines()
+    def execute(self, cmd):
+        if self.ssh is None or not self.ssh.get_transport() or not self.ssh.get_transport().is_active():
+            self.ssh = paramiko.SSHClient()
+            self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            self.ssh.connect(self.name+host_domain, username=self.user, password=self.pswd, timeout=10)
+        stdin, stdout, stderr = self.ssh.exec_command(cmd)
+        return stdout.readlines() + stderr.readlines()
 
+    def close(self):
+        if self.ssh is not None:
+            self.ssh.close()
+            self.ssh = None
 
-def search_process_on_server(server, user, pswd, verbose):
-    print("Connecting to: {0}".format(server)),
 
-    try:
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.connect(server, username=user, password=pswd, timeout=10)
-
-        num = get_num_processes(ssh, verbose)
-        if not verbose:
-            print(": {0}". format(num))
-
-        ssh.close()
-    except:
-        print("FAILED.")
+def is_evolution(comm):
+    """ evolution binary of any version, e.g. evolution-1.0.1, not the launcher """
+    return comm.startswith("evolution") and comm != "evolution.py"
 
-def kill_process_on_server(server, user, pswd):
-    print("Connecting to: {0}".format(server)),
 
+def get_status(host):
+    """ returns dict with cores, load and process counts or the error """
     try:
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.connect(server, username=user, password=pswd, timeout=10)
-
-        kill(ssh, "evolution.py")
-        kill(ssh, "simloid")
-        kill(ssh, "evolution")
-
-
-        ssh.close()
-        print("KILLED.")
-    except:
-        print("FAILED.")
+        lines = host.execute(status_cmd)
+    except Exception as e:
+        host.close()
+        return {"error": str(e)}
+    procs = [l.strip() for l in lines[2:]]
+    return { "cores"    : int(lines[0])
+           , "load"     : float(lines[1].split()[0])
+           , "simloid"  : procs.count("simloid")
+           , "evolution": len([p for p in procs if is_evolution(p)])
+           , "launcher" : procs.count("evolution.py")
+           , "procs"    : [p for p in procs if p in ["simloid", "evolution.py"] or is_evolution(p)]
+           }
+
+
+def is_broken(status):
+    """ every evolution binary drives exactly one simloid """
+    return status["evolution"] != status["simloid"]
+
+
+def print_status(hosts, states, verbose):
+    print("{0:10} {1:>5} {2:>6} {3:>7} {4:>9} {5:>8}".format("host", "cores", "load", "simloid", "evolution", "launcher"))
+    total = 0
+    for host, s in zip(hosts, states):
+        if "error" in s:
+            print("{0:10} FAILED: {1}".format(host.name, s["error"]))
+            continue
+        print("{0:10} {1:5d} {2:6.2f} {3:7d} {4:9d} {5:8d} {6}"
+              .format(host.name, s["cores"], s["load"], s["simloid"], s["evolution"], s["launcher"]
+                     , "WARNING: broken process chain." if is_broken(s) else ""))
+        if verbose:
+            for p in s["procs"]:
+                print("    {0}".format(p))
+        total += s["simloid"]
+    print("{0:10} {1:28d}".format("total", total))
+
+
+def poll_all(pool, hosts):
+    return pool.map_async(get_status, hosts).get(0xFFFF)
+
+
+def search_all(hosts, verbose):
+    pool = ThreadPool(len(hosts))
+    print_status(hosts, poll_all(pool, hosts), verbose)
+    pool.close()
+
+
+def monitor(hosts, interval, verbose):
+    pool = ThreadPool(len(hosts))
+    try:
+        while True:
+            states = poll_all(pool, hosts)
+            sys.stdout.write("\033[2J\033[H") # clear screen
+            print(time.strftime("%Y-%m-%d %H:%M:%S"))
+            print_status(hosts, states, verbose)
+            sys.stdout.flush()
+            time.sleep(interval)
+    except (KeyboardInterrupt, SystemExit):
+        print("Aborted by user.")
+    finally:
+        pool.close()
+
+
+def kill(host):
+    try:
+        for processname in ["evolution.py", "simloid", "evolution"]:
+            host.execute("pkill -f -9 {}".format(processname))
+        return "KILLED."
+    except Exception as e:
+        return "FAILED: {0}".format(e)
 
 
-def search_all(server_list, user, pswd, verbose):
-    for server in server_list:
-        search_process_on_server(server+host_domain, user, pswd, verbose)
+def kill_all(hosts):
+    pool = ThreadPool(len(hosts))
+    for host, result in zip(hosts, pool.map_async(kill, hosts).get(0xFFFF)):
+        print("{0:10} {1}".format(host.name, result))
+    pool.close()
 
-def kill_all(server_list, user, pswd):
-    for server in server_list:
-        kill_process_on_server(server+host_domain, user, pswd)
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-v', '--verbose', action='store_true')
     parser.add_argument('-k', '--kill'   , action='store_true')
+    parser.add_argument('-m', '--monitor', action='store_true')
+    parser.add_argument('-i', '--interval', default=10.0, type=float)
     args = parser.parse_args()
 
     user = raw_input("Username: ")
@@ -101,11 +148,17 @@ def main():
         return
 
     pswd = getpass.getpass()
+    hosts = [Host(server, user, pswd) for server in server_list]
 
     if args.kill:
-        kill_all(server_list, user, pswd)
+        kill_all(hosts)
+    elif args.monitor:
+        monitor(hosts, args.interval, args.verbose)
     else:
-        search_all(server_list, user, pswd, args.verbose)
+        search_all(hosts, args.verbose)
+
+    for host in hosts:
+        host.close()
     print("\n____\nDONE.")
 
 if __name__ == "__main__": main()
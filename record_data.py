@@ -18,6 +18,7 @@ from os.path import isfile, isdir, exists
 from tableau20 import tableau20
 import subprocess
 from common import *
+from ports import leased_port
 
 
 
@@ -28,7 +29,6 @@ settings_file_ending = ".setting"
 default_port = 8000
 nice = 19
 binary = "./bin/Release/evolution"       # TODO: use robot_watch for this, check if better suited?
-ansi_escape = re.compile(r'\x1b[^m]*m')
 
 from os import listdir
 def prepare_figure():
@@ -45,7 +45,7 @@ def prepare_figure():
     ax.get_xaxis().tick_bottom()
 
 
-def conduct(robot, expname, port, dry = False, log_data = False, log_video = False):
+def conduct(robot, expname, dry = False, log_data = False, log_video = False):
     target_dir = "{0}{1}/{2}".format(data_path, expname, output_folder)
 
     if (log_data or log_video):
@@ -55,18 +55,15 @@ def conduct(robot, expname, port, dry = False, log_data = False, log_video = Fal
         add_args += " --include_video --no_pause --outfile {0}/video.log".format(target_dir) if log_video else " --blind"
 
     command = "nice -n {3} {0} --watch {1} --port {2} {4}"\
-        .format(binary, expname, port, nice, add_args)
+        .format(binary, expname, "{0}", nice, add_args)
 
     if not dry:
         output_path = "{0}{1}/".format(data_path, expname)
-        exitcode, out, err = execute_command(command)
-        with open(output_path + "stdout.txt", "w") as out_file:
-            out_file.write(ansi_escape.sub('', out))
-        with open(output_path + "stderr.txt", "w") as err_file:
-            err_file.write(ansi_escape.sub('', err))
+        with leased_port(default_port) as port:
+            exitcode = execute_logged(command.format(port), output_path)
         print "OK." if exitcode==0 else "FAILED. Code {0}".format(exitcode)
     else:
-        print("\n" + command)
+        print("\n" + command.format("<port>"))
 
 
 def main():
@@ -98,7 +95,6 @@ def main():
 
     target.experiments = get_experiments(target)
     target.group = group_experiments(target)
-    port = default_port
 
     try:
         for r in target.group:
@@ -110,14 +106,13 @@ def main():
 
             print(best_exp_name)
 
-            conduct(robot, best_exp_name, port, dry=args.dry, log_data=args.log_data, log_video=args.log_video)
+            conduct(robot, best_exp_name, dry=args.dry, log_data=args.log_data, log_video=args.log_video)
 
             if args.log_video:
                 directory = "data/"+robot
                 create_folder(directory)
                 subprocess.call(['./ppm2avi.sh {0}'.format(best_exp_name)], shell=True)
 
-            port+=1
     except (KeyboardInterrupt, SystemExit):
         print("\naborted\n")
 
@@ -9,7 +9,8 @@
     + phi, phi_dot and u per joint vs. time
 '''
 
-import re, argparse, shlex
+import re, os, json, argparse, shlex
+from io import BytesIO
 from subprocess import Popen
 
 import pandas as pd
@@ -20,6 +21,10 @@ from tableau20 import tableau20
 from common import *
 
 
+cache_ending = ".cache/" # folder with one .npy file per column next to the log
+index_ending = ".episodes.json"
+block_size   = 1 << 20
+episode_start = re.compile(b"(?:^|\n)0 ") # cycles column is reset to 0
 
 
 def plot_joints(jp,jv,ju, save = False):
@@ -59,24 +64,152 @@ def plot_phase_space(jp,jv,ju, save = False):
         plt.savefig("{0}{1}".format(experiment, pdfname), bbox_inches="tight")
 
 
-def read_data_log(filename, columns):
+def is_cache_valid(filename, columns):
+    """ cache exists and was made from the current log with these columns """
+    try:
+        with open(filename + cache_ending + "meta.json") as f:
+            meta = json.load(f)
+    except (IOError, ValueError):
+        return False
+    return meta["stamp"] == get_stamp(filename) and meta["columns"] == columns
+
+
+def convert_data_log(filename, columns):
+    """ parses the text log once and stores each column as .npy file,
+        chunk by chunk into memory-mapped files, so the whole log is
+        never held in memory """
+    print("converting: {0}".format(filename))
+    stamp = get_stamp(filename)
+    folder = filename + cache_ending
+    create_folder(folder)
+    rows, chunks = read_chunks(filename)
+    files = [folder + c + ".npy" for c in columns]
+    out = [np.lib.format.open_memmap(f, mode="w+", shape=(max(rows, 1),), dtype=np.int64 if c == "cycles" else np.float64)
+           for f, c in zip(files, columns)]
+    row = 0
+    for values in chunks:
+        if values.shape[1] != len(columns):
+            raise ValueError("{0} has {1} columns, expected {2}.".format(filename, values.shape[1], len(columns)))
+        for i in range(len(columns)):
+            out[i][row:row+len(values)] = values[:, i]
+        row += len(values)
+    if row < len(out[0]):
+        # blank lines were counted as rows, the columns are cut to the parsed rows
+        for f, values in zip(files, out):
+            with open(f + ".tmp", "wb") as fp:
+                np.save(fp, values[:row])
+            os.rename(f + ".tmp", f)
+    del out
+    # meta is written last, an interrupted conversion is never valid
+    write_atomic(folder + "meta.json", json.dumps({"stamp": stamp, "columns": columns}))
+
+
+def downcast(data, dtype):
+    """ float columns as dtype, e.g. np.float32, to halve the memory """
+    if dtype is not None:
+        for c in data.columns:
+            if data[c].dtype.kind == "f":
+                data[c] = data[c].astype(dtype)
+    return data
+
+
+def load_columns(filename, usecols, rows = slice(None), dtype = None):
+    """ rows of the given columns from the memory-mapped cache,
+        only these are copied into memory """
+    folder = filename + cache_ending
+    data = {}
+    for c in usecols:
+        values = np.load(folder + c + ".npy", mmap_mode="r")[rows]
+        data[c] = values.astype(dtype) if dtype is not None and values.dtype.kind == "f" else np.array(values)
+    return pd.DataFrame(data, columns=usecols)
+
+
+def read_data_log(filename, columns, usecols = None, dtype = None):
+    """ columns of data.log as DataFrame, read from the memory-mapped
+        binary cache, which is created or renewed when the log changed """
     print("reading: {0}".format(filename))
-    return pd.read_csv(filename, sep=' ', header=None, names=columns)
+    if not is_cache_valid(filename, columns):
+        convert_data_log(filename, columns)
+    return load_columns(filename, usecols or columns, dtype=dtype)
+
+
+def scan_episodes(filename):
+    """ row and byte offsets of all lines starting an episode """
+    rows, offsets = [], []
+    row, offset, rest = 0, 0, b""
+    with open(filename, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            data = rest + block
+            end = data.rfind(b"\n") + 1 # scan complete lines only, data starts at a line
+            last = 0
+            for m in episode_start.finditer(data, 0, end):
+                pos = m.end() - 2 # start of the line
+                row += data.count(b"\n", last, pos)
+                last = pos
+                rows.append(row)
+                offsets.append(offset + pos)
+            row += data.count(b"\n", last, end)
+            offset += end
+            rest = data[end:]
+    return {"rows": rows + [row], "offsets": offsets + [offset]}
+
+
+def get_episode_index(filename):
+    """ episode starts of data.log plus the end of the log,
+        stored next to the log and renewed when it changed """
+    index_file = filename + index_ending
+    try:
+        with open(index_file) as f:
+            index = json.load(f)
+        if index["stamp"] == get_stamp(filename):
+            return index
+    except (IOError, ValueError):
+        pass
+    index = scan_episodes(filename)
+    index["stamp"] = get_stamp(filename)
+    write_atomic(index_file, json.dumps(index))
+    return index
+
+
+def read_rows(filename, columns, start, end, usecols = None, dtype = None):
+    """ rows [start:end) given as row and byte offsets (start, end) """
+    usecols = usecols or columns
+    if is_cache_valid(filename, columns):
+        return load_columns(filename, usecols, slice(start[0], end[0]), dtype)
+    with open(filename, "rb") as f:
+        f.seek(start[1])
+        data = f.read(end[1] - start[1])
+    return downcast(pd.read_csv(BytesIO(data), sep=' ', header=None, names=columns, usecols=usecols)[usecols], dtype)
+
+
+def read_episode(filename, columns, episode = 0, usecols = None, dtype = None):
+    """ one episode of data.log, without parsing the rest of the log """
+    print("reading episode {1}: {0}".format(filename, episode))
+    index = get_episode_index(filename)
+    rows, offsets = index["rows"], index["offsets"]
+    if episode >= len(rows) - 1:
+        raise IndexError("{0} has only {1} episodes".format(filename, len(rows) - 1))
+    return read_rows(filename, columns, (rows[episode], offsets[episode]),
+                     (rows[episode+1], offsets[episode+1]), usecols, dtype)
 
 
 def get_time(data, tmin = None, tmax = None):
+    """ start and end of the first episode within [tmin, tmax) """
     timesteps = np.array(data["cycles"])
-    ii = np.where(timesteps == 0)[0]
+    ii = np.append(np.where(timesteps == 0)[0], len(timesteps))
     ts = max(tmin, ii[0]) if tmin else ii[0] # start
     te = min(tmax, ii[1]) if tmax else ii[1] # end
     return ts, te
 
-def read_and_plot_single_experiment(expname):
+def read_and_plot_single_experiment(expname, dtype = None):
     print("Plotting: {0}".format(expname))
     rid = get_robot_id(expname)
     columns = create_columns(rid)
-    data = read_data_log(expname+"/data/"+constants.data_log, columns)
-    data.ename = expname
+    usecols = ["cycles"] + [c for c in columns if re.match(r"[pvu]\d+$", c)] + ["avg_pos_y", "avg_vel_fw", "avg_vel_y"]
+    data = read_episode(expname+"/data/"+constants.data_log, columns, 0, usecols, dtype)
 
     ts, te = get_time(data, 0,2000)
     print("plotting from timestep {0} to {1}".format(ts,te))
@@ -96,7 +229,11 @@ def read_and_plot_single_experiment(expname):
     plot_joints(jp,jv,ju)
     #plot_phase_space(jp,jv,ju)
     #plot_walked_distance(avg_pos_y,avg_vel_fw)
-    return data
+
+    # keep only what is needed for comparing all experiments
+    reduced = data[["cycles", "avg_pos_y", "avg_vel_y"]]
+    reduced.ename = expname
+    return reduced
 
 
 def plot_all_experiment(data_all):
@@ -121,6 +258,7 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-f', '--filter' , default='')
     parser.add_argument('-p', '--path'   , default=constants.exp_dir)
+    parser.add_argument('-s', '--single' , action='store_true', help="load floats as float32")
     args = parser.parse_args()
 
     experiments = get_all_experiments(args.path, args.filter, recorded_only=True)
@@ -128,7 +266,7 @@ def main():
     print("Processing experiments:")
     data_all = []
     for e in experiments:
-        data_all.append(read_and_plot_single_experiment(e))
+        data_all.append(read_and_plot_single_experiment(e, np.float32 if args.single else None))
         #exit() #remove
     if len(data_all) > 0:
         plot_all_experiment(data_all)
@@ -1,8 +1,11 @@
 #!/usr/bin/python
 
-import re, argparse
-from os import listdir, makedirs
+import re, sys, time, argparse
+from datetime import timedelta
+from multiprocessing.pool import ThreadPool
+from os import makedirs
 from os.path import isfile, isdir
+from expindex import open_index
 
 #TODO use code from common
 #from common import *
@@ -14,6 +17,8 @@ log_file  = "evolution.log"
 fit_log   = "fitness.log"
 pop_file  = "population.log"
 seed_fend = ".dat"
+pool      = None # looks up experiments concurrently, if set
+window    = 6    # number of samples the trial rate is averaged over
 
 behaviors = { "0fw" : "forwards"
             , "1bw" : "backwards"
@@ -58,38 +63,27 @@ def get_best_individual(path):
         return first
 
 
-def get_number_of_cur_trials(path):
-    log = path+"/"+log_file
-    if not isfile(log):
-        return 0
-    return sum(1 for line in open(log))
+def get_entries(paths):
+    """ index entries of all paths, in the same order """
+    if pool is None:
+        return [open_index().get(p) for p in paths]
+    # async get with timeout keeps the pool interruptible by Ctrl-C
+    return pool.map_async(open_index().get, paths).get(0xFFFFFFFF)
 
 
-def is_experiment(path):
-    return isdir(path) \
-        and isfile(path+"/"+conf_file) \
-        and isfile(path+"/"+log_file)
+def is_experiment(entry):
+    return entry is not None and entry["has_log"]
 
 
 def is_symmetric_controller(path):
-    conf = path+"/"+conf_file
-    with open(conf) as f:
-        data = f.read()
-    m = re.search("SYMMETRIC_CONTROLLER = (YES|NO)", data)
-    if m:
-        return True if m.groups()[0]=="YES" else False
-    print("ERROR: Did not find symmetric controller entry in {0}".format(conf))
-    return False
+    entry = open_index().get(path)
+    return entry is not None and entry["symmetric"]
 
 
-def get_number_of_max_trials(path):
-    conf = path+"/"+conf_file
-    with open(conf) as f:
-        data = f.read()
-    m = re.search("MAX_TRIALS = (\d+)", data)
-    if m:
-        return int(m.groups()[0])
-    print("ERROR: Did not find max. trials entry in {0}".format(conf))
+def get_number_of_max_trials(path, entry):
+    if entry["max_trials"] > 0:
+        return entry["max_trials"]
+    print("ERROR: Did not find max. trials entry in {0}".format(path+"/"+conf_file))
     return 1 # avoid devision by zero
 
 
@@ -97,14 +91,14 @@ def find_experiments(path, filt, getseed, dir_level = 0):
     total = 0
     number = 0
     try:
-        dirs = [d for d in listdir(path) if isdir(path+"/"+d)]
+        dirs = open_index().subdirs(path)
     except:
         print("Error while scanning folders.")
         return
-    dirs.sort()
-    for d in dirs:
+    entries = get_entries([path+"/"+d for d in dirs])
+    for d, entry in zip(dirs, entries):
         exp_path = path+"/"+d
-        if not is_experiment(exp_path):
+        if not is_experiment(entry):
             print(" {1} [{0}]".format(d, " " * (3*dir_level) + " + "))
             find_experiments(exp_path, filt, getseed, dir_level+1)
             #print
@@ -113,10 +107,10 @@ def find_experiments(path, filt, getseed, dir_level = 0):
         if filt and filt not in d:
             continue
 
-        max_trials = get_number_of_max_trials(exp_path)
-        cur_trials = get_number_of_cur_trials(exp_path)
+        max_trials = get_number_of_max_trials(exp_path, entry)
+        cur_trials = entry["trials"]
         result = int(cur_trials*100.0/max_trials)
-        avgf,maxf = get_avg_fitness(exp_path)
+        avgf,maxf = get_avg_fitness(entry)
         print("{5}{0:32} {1:3d}% ({2:6d}/{3:6d}) {4} f:{6: 7.3f} ({7: 7.3f})".format(d, result, cur_trials, max_trials, "OK." if result==100 else "", dir_level*"\t", avgf,maxf)),
         number += 1
         total += result
@@ -134,12 +128,81 @@ def find_experiments(path, filt, getseed, dir_level = 0):
         print("{3}{0:32} {1:3d}% {2}".format("Total: ", total/number, "COMPLETE." if int(total/number)==100 else "", dir_level*"\t"))
 
 
-def get_avg_fitness(path):
-    if not isfile(path+"/"+fit_log):
+def get_avg_fitness(entry):
+    fitness = entry["fitness"]
+    if fitness["count"] == 0:
         return (0.0,0.0)
-    with open(path+"/"+fit_log) as f:
-        lines = [float(x) for x in f.readlines()]
-    return (sum(lines)/len(lines), max(lines)) if len(lines) > 0 else (0.0,0.0)
+    return (fitness["sum"]/fitness["count"], fitness["max"])
+
+
+def collect_experiments(path, filt, prefix = ""):
+    """ list of (name, entry) of all experiments below path """
+    experiments = []
+    dirs = open_index().subdirs(path)
+    for d, entry in zip(dirs, get_entries([path+"/"+d for d in dirs])):
+        if not is_experiment(entry):
+            experiments += collect_experiments(path+"/"+d, filt, prefix+d+"/")
+        elif not filt or filt in d:
+            experiments.append((prefix+d, entry))
+    return experiments
+
+
+def format_eta(seconds):
+    return str(timedelta(seconds=int(seconds))) if seconds is not None else "--:--:--"
+
+
+class Progress:
+    """ trials per second of a run, averaged over the last samples """
+    def __init__(self):
+        self.samples = []
+        self.grown = time.time()
+
+    def add(self, now, trials):
+        if self.samples and trials > self.samples[-1][1]:
+            self.grown = now
+        self.samples = (self.samples + [(now, trials)])[-window:]
+
+    def rate(self):
+        (t0, n0), (t1, n1) = self.samples[0], self.samples[-1]
+        return (n1 - n0) / (t1 - t0) if t1 > t0 else 0.0
+
+
+def follow(path, filt, interval, stall_after):
+    """ re-samples all runs and shows their throughput and eta """
+    progress = {}
+    while True:
+        now = time.time()
+        running = []
+        completed = 0
+        for name, entry in collect_experiments(path, filt):
+            max_trials = max(1, entry["max_trials"])
+            if entry["status"] == 2 or entry["trials"] >= max_trials:
+                completed += 1
+                continue
+            p = progress.setdefault(name, Progress())
+            p.add(now, entry["trials"])
+            running.append((name, entry["trials"], max_trials, p))
+
+        sys.stdout.write("\033[2J\033[H") # clear screen
+        print("{0}  {1} running, {2} completed".format(time.strftime("%Y-%m-%d %H:%M:%S"), len(running), completed))
+        print("{0:40} {1:>15} {2:>5} {3:>9} {4:>10}".format("experiment", "trials", "%", "trials/s", "eta"))
+        total_rate, remaining = 0.0, 0
+        for name, trials, max_trials, p in running:
+            rate = p.rate()
+            total_rate += rate
+            remaining += max_trials - trials
+            stalled = now - p.grown > stall_after
+            line = "{0:40} {1:7d}/{2:7d} {3:4d}% {4:9.2f} {5:>10} {6}".format(
+                name, trials, max_trials, trials*100/max_trials, rate,
+                format_eta((max_trials - trials) / rate if rate > 0 else None),
+                "STALLED" if stalled else "")
+            print("\033[31m{0}\033[0m".format(line) if stalled else line)
+        print("-"*80)
+        print("{0:40} {1:15d} {2:>5} {3:9.2f} {4:>10}".format("Total (remaining)", remaining, "",
+              total_rate, format_eta(remaining / total_rate if total_rate > 0 else None)))
+        sys.stdout.flush()
+        open_index().save()
+        time.sleep(interval)
 
 
 def main():
@@ -147,6 +210,10 @@ def main():
     parser.add_argument('-f', '--filter' , default='')
     parser.add_argument('-p', '--path'   , default=exp_dir)
     parser.add_argument('-g', '--getseed', default='')
+    parser.add_argument('-j', '--jobs'   , default=16, type=int, help="parallel lookups, 1 scans serially")
+    parser.add_argument(      '--follow' , action='store_true', help="show trials/s and eta until Ctrl-C")
+    parser.add_argument('-i', '--interval', default=10.0, type=float)
+    parser.add_argument('-s', '--stalled', default=120.0, type=float, help="seconds without new trials")
     args = parser.parse_args()
 
     filt = str(args.filter)
@@ -156,11 +223,21 @@ def main():
     if args.getseed and not isdir(lib_dir+"/"+args.getseed):
         makedirs(lib_dir+"/"+args.getseed)
 
+    global pool
+    if args.jobs > 1:
+        pool = ThreadPool(args.jobs)
+
     if isdir(path):
         try:
-            find_experiments(path, filt, getseed = args.getseed)
+            if args.follow:
+                follow(path, filt, args.interval, args.stalled)
+            else:
+                find_experiments(path, filt, getseed = args.getseed)
         except (KeyboardInterrupt, SystemExit):
             print("Aborted by user.")
+        finally:
+            if pool is not None:
+                pool.close()
     else:
         print("ERROR: Wrong path.")
         exit(-1)
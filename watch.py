@@ -4,10 +4,11 @@
 # + lists available experiments by filter arument -f
 # + enumerates and asks for index number of experiment to be watched
 
-import re, argparse, shlex
+import argparse, shlex
 from subprocess import Popen
-from os import listdir, mkdir
-from os.path import isfile, isdir
+from os.path import isdir
+from ports import leased_port
+from expindex import open_index
 
 exp_dir   = "../data/exp"
 conf_file = "evolution.conf"
@@ -19,29 +20,25 @@ port0 = 8000
 what_state = [2]
 
 def is_experiment(path):
-    return isdir(path) \
-        and isfile(path+"/"+conf_file)
+    return open_index().get(path) is not None
 
 
 def is_completed(path):
-    conf = path+"/"+conf_file
-    with open(conf) as f:
-        data = f.read()
-    m = re.search("STATUS = (\d+)", data)
-    if m:
-        return int(m.groups()[0]) in what_state
-    print("ERROR: Did not find max. status entry in {0}".format(conf))
-    return False
+    entry = open_index().get(path)
+    if entry is None:
+        return False
+    if entry["status"] < 0:
+        print("ERROR: Did not find max. status entry in {0}".format(path+"/"+conf_file))
+    return entry["status"] in what_state
 
 
 def find_experiments(path, filt, dir_level = 0):
     number = 0
     try:
-        dirs = [d for d in listdir(path) if isdir(path+"/"+d)]
+        dirs = open_index().subdirs(path)
     except:
         print("Error while scanning folders.")
         return
-    dirs.sort()
     for d in dirs:
         exp_path = path+"/"+d
         if not is_experiment(exp_path):
@@ -68,17 +65,18 @@ def execute_command(command):
     return proc.returncode
 
 
-def watch(expname, port, dry = False, log = False):
+def watch(expname, dry = False, log = False):
     cmd_bin = binary
     if log:
         cmd_bin += logging_options
 
-    command = "{0} -w {1} -p {2}".format(cmd_bin, expname, port + port0)
-    if not dry:
-        exitcode = execute_command(command)
-        print "OK." if exitcode==0 else "FAILED. Code {0}".format(exitcode)
-    else:
-        print(command)
+    with leased_port(port0) as port:
+        command = "{0} -w {1} -p {2}".format(cmd_bin, expname, port)
+        if not dry:
+            exitcode = execute_command(command)
+            print "OK." if exitcode==0 else "FAILED. Code {0}".format(exitcode)
+        else:
+            print(command)
 
 def show_experiments():
     for idx,expname in enumerate(exp_list):
@@ -109,7 +107,7 @@ def main():
         if inp.isdigit():
             idx_num = int(inp)
             if 0 <= idx_num < len(exp_list):
-                watch(exp_list[idx_num], idx_num, log = args.logging)
+                watch(exp_list[idx_num], log = args.logging)
         if inp == "":
             break
         else:
@@ -20,7 +20,7 @@ def show_weights_of_population(experiments):
     N = len(experiments)
     maxv = 0
     for idx,e in enumerate(experiments):
-        Y = np.loadtxt(e+"/population.log")
+        Y = read_log(e+"/population.log")
         y = Y[0,:]
         maxv = max(maxv, max(abs(y)))
         x = range(len(y))
@@ -56,7 +56,7 @@ def show_weights_as_matrix(experiment):
     num_j = constants.num_joints[robot_id]
     w_names = create_weight_names(num_j,robot_id)
     num_w = num_j*(3*num_j+4)
-    Y = np.loadtxt(experiment+"/population.log")
+    Y = read_log(experiment+"/population.log")
     y = Y[0,:]
     
     assert(len(y) == num_w or len(y) == num_w//2)
@@ -92,7 +92,7 @@ def show_weights_as_matrix(experiment):
 
 
 def show_weight_histogram(experiment):
-    Y = np.loadtxt(experiment+"/population.log")
+    Y = read_log(experiment+"/population.log")
     data = Y[0,:]
 
     plt.figure(figsize=(8, 3))
@@ -122,7 +122,7 @@ def show_evolution_of_weights(experiment):
     fig = plt.figure()
     ax  = plt.gca()
 
-    Y = np.loadtxt(experiment+"/bestindiv.log")
+    Y = read_log(experiment+"/bestindiv.log")
     y = Y[:,:]
     plt.plot(y)
 